@@ -0,0 +1,79 @@
+"""Per-call overhead of the auth lookups: `select()` vs `lambda_stmt`.
+
+Run from the root of the project:
+
+    python -m benchmarks.auth_queries [--calls 20000]
+
+`select()` builds the statement and its cache key on every call,
+`lambda_stmt` builds them once and then only extracts the parameters.
+"""
+import argparse
+import asyncio
+import time
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from src.db.database import Base
+from src.users.models import UserTable, orm
+
+USERS = 1000
+
+
+async def measure(name: str, lookup, db: AsyncSession, calls: int) -> None:
+    start = time.perf_counter()
+    for i in range(calls):
+        await lookup(db, 79000000000 + i % USERS)
+    elapsed = time.perf_counter() - start
+    print(f'{name:>22}: {elapsed / calls * 1e6:7.1f} us/call')
+
+
+async def main(calls: int) -> None:
+    engine = create_async_engine('sqlite+aiosqlite:///:memory:')
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    session = sessionmaker(bind=engine, class_=AsyncSession)
+    async with session() as db:
+        await orm.bulk_create(db, [
+            {
+                'username': f'user{i}',
+                'phone': 79000000000 + i,
+                'password': 'x' * 60,
+                'is_active': True,
+            }
+            for i in range(USERS)
+        ])
+
+        async def select_entity(db: AsyncSession, phone: int):
+            return await orm.get_user_by_phone(db, phone)
+
+        async def select_columns(db: AsyncSession, phone: int):
+            return (await db.execute(select(
+                UserTable.id,
+                UserTable.username,
+                UserTable.phone,
+                UserTable.is_active,
+                UserTable.is_staff,
+            ).where(UserTable.phone == phone).limit(1))).first()
+
+        async def cached_columns(db: AsyncSession, phone: int):
+            return await orm.get_auth_user(db, phone=phone)
+
+        for name, lookup in (
+            ('select(UserTable)', select_entity),
+            ('select(columns)', select_columns),
+            ('lambda_stmt(columns)', cached_columns),
+        ):
+            await lookup(db, 79000000000)  # warm up the cache
+            await measure(name, lookup, db, calls)
+            db.expunge_all()
+
+    await engine.dispose()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--calls', type=int, default=20000)
+    asyncio.run(main(parser.parse_args().calls))
@@ -0,0 +1,83 @@
+"""Throughput of concurrent registrations with and without SQLite pragmas.
+
+Run from the root of the project:
+
+    python -m benchmarks.sqlite_pragmas [--users 2000] [--concurrency 50]
+
+Every registration is a separate session with one `INSERT` and a commit,
+like `POST /registration` without hashing the password.
+"""
+import argparse
+import asyncio
+import tempfile
+import time
+from pathlib import Path
+
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
+    AsyncSession,
+    create_async_engine,
+)
+from sqlalchemy.orm import sessionmaker
+
+from src.db.database import Base, create_engine
+from src.users.models import UserTable
+
+
+async def register_users(
+    engine: AsyncEngine, users: int, concurrency: int
+) -> tuple[float, int]:
+    """Returns the number of registrations per second and lock errors.
+    """
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    session = sessionmaker(
+        bind=engine, class_=AsyncSession, expire_on_commit=False
+    )
+    semaphore = asyncio.Semaphore(concurrency)
+    errors = 0
+
+    async def register(i: int) -> None:
+        nonlocal errors
+        async with semaphore, session() as db:
+            db.add(UserTable(
+                username=f'user{i}',
+                phone=79000000000 + i,
+                password='x' * 60,
+                is_active=True,
+            ))
+            try:
+                await db.commit()
+            except OperationalError:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(register(i) for i in range(users)))
+    elapsed = time.perf_counter() - start
+    await engine.dispose()
+    return users / elapsed, errors
+
+
+async def main(users: int, concurrency: int) -> None:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        default = create_async_engine(
+            f'sqlite+aiosqlite:///{Path(temp_dir) / "default.db"}',
+            connect_args={'check_same_thread': False},
+        )
+        tuned = create_engine(
+            f'sqlite+aiosqlite:///{Path(temp_dir) / "tuned.db"}'
+        )
+        for name, engine in (('default', default), ('pragmas', tuned)):
+            rate, errors = await register_users(engine, users, concurrency)
+            print(f'{name:>8}: {rate:8.0f} registrations/s, '
+                  f'{errors} lock errors')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(main(args.users, args.concurrency))
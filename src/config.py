@@ -9,6 +9,21 @@ AVATARS_DIR = MEDIA_DIR / 'avatars'
 
 AVATAR_SIZES = [(400, 400), (100, 100), (50, 50)]
 
+# Media types of avatar formats by file extension. `png` is always saved
+# and is the fallback format.
+AVATAR_FORMATS = {
+    'avif': 'image/avif',
+    'webp': 'image/webp',
+    'png': 'image/png',
+}
+# Quality of the lossy formats for every avatar width.
+# `avif` is saved only if the `pillow-avif-plugin` package is installed.
+AVATAR_QUALITY: dict[int, dict[str, int]] = {
+    400: {'webp': 80, 'avif': 60},
+    100: {'webp': 80, 'avif': 60},
+    50: {'webp': 90, 'avif': 70},
+}
+
 
 class AppSettings(BaseSettings):
     """Get settings from `.env` file.
@@ -16,12 +31,68 @@ class AppSettings(BaseSettings):
     Use uppercase for the names of the values in the file.
     """
     debug: bool = False
+    metrics_enabled: bool = True  # `/metrics` in the Prometheus format
+    profiling_token: str = ''  # `X-Profile` header to profile a request
+    profiling_sample_rate: float = 0  # part of requests to profile
+    profiling_keep: int = 20  # saved profiles, the oldest are removed
+    profiles_dir: Path = MEDIA_DIR / 'profiles'
     path: str  # ENV PATH from os
     app_title: str = 'Template'
     secret_key: str = ',gcf975'  # salt for hashing password
     algorithm: str = 'HS256'  # algorithm for hashing password
+    # PEM files of private keys for `RS*`/`ES*`, the signing key
+    # first, then the previous ones still accepted after a rotation.
+    jwt_private_key_files: list[str] = []
+    jwks_max_age: int = 3600  # `Cache-Control: max-age` of the JWKS
     access_token_expire_minutes: int = 60
+    self_contained_tokens: bool = False  # put the user data into tokens
+    revocation_capacity: int = 100_000  # revoked tokens in the Bloom filter
+    revocation_refresh: float = 30  # seconds between reloads of the filter
     database_url: str = 'sqlite+aiosqlite:///./sqlite.db'
+    database_replica_urls: list[str] = []  # read-only replicas, JSON list
+    replica_retry_after: float = 5  # seconds a failed replica is skipped
+    replica_check_interval: float = 1  # seconds a checked replica is trusted
+    db_pool_size: int = 5  # connections kept open
+    db_max_overflow: int = 10  # extra connections under load
+    db_pool_recycle: int = 3600  # seconds before reconnecting, -1 - never
+    db_pool_pre_ping: bool = False  # check connections before use
+    sqlite_journal_mode: str = 'WAL'  # readers do not block the writer
+    sqlite_synchronous: str = 'NORMAL'  # no fsync per commit with `WAL`
+    sqlite_cache_size: int = -64_000  # pages, negative - KiB
+    sqlite_mmap_size: int = 256 * 1024 * 1024  # bytes, 0 - off
+    sqlite_busy_timeout: int = 5000  # ms to wait for a lock
+    slow_query_ms: float = 100  # log slower SQL statements, 0 - off
+    bcrypt_rounds: int = 12  # see `python -m src.users.calibrate`
+    login_rate_window: float = 60  # seconds
+    login_rate_per_ip: int = 20  # `/token` attempts per window, 0 - off
+    login_rate_per_phone: int = 5  # attempts per window, 0 - off
+    throttle_backend: str = 'memory'  # `memory` or `redis`
+    redis_url: str = 'redis://localhost:6379/0'
+    hash_pool_size: int = 2  # processes for password hashing, 0 - threads
+    hash_queue_size: int = 64  # pending hashing jobs before `503`
+    user_cache_size: int = 10_000  # authenticated users in memory, 0 - off
+    user_cache_ttl: float = 60  # seconds
+    token_cache_size: int = 10_000  # verified JWT tokens, 0 - off
+    avatar_pool_size: int = 1  # processes for resizing avatars, 0 - threads
+    avatar_queue_size: int = 32  # pending avatar jobs before `503`
+    avatar_max_upload_bytes: int = 5 * 1024 * 1024
+    avatar_cache_max_age: int = 300  # `Cache-Control: max-age` of avatars
+    avatar_cache_bytes: int = 16 * 1024 * 1024  # small avatars in memory
+    avatar_cache_ttl: float = 60  # seconds, changes of other workers
+    avatar_cache_miss_ttl: float = 5  # seconds a missing avatar is cached
+    # Delete avatars no user refers to. The references are counted safely
+    # in one process only: disable with several workers or nodes.
+    avatar_delete_unreferenced: bool = True
+    import_batch_size: int = 500  # users inserted with one statement
+    export_chunk_size: int = 1000  # users read with one query
+    users_page_size: int = 50  # default page of the users list
+    users_page_max_size: int = 500
+    avatar_storage: str = 'local'  # `local` or `s3`
+    s3_endpoint_url: str = 'http://localhost:9000'
+    s3_bucket: str = 'avatars'
+    s3_access_key: str = ''
+    s3_secret_key: str = ''
+    s3_region: str = 'us-east-1'
 
     class Config:
         env_file = '.env'
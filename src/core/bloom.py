@@ -0,0 +1,46 @@
+from hashlib import blake2b
+from math import ceil, log
+
+
+class BloomFilter:
+    """A set of strings without false negatives and with rare false
+    positives, in a fixed number of bits.
+
+    Items can not be removed, the filter is rebuilt instead.
+    """
+    def __init__(self, capacity: int, error_rate: float = 0.001) -> None:
+        """
+        #### Args:
+          - capacity (int):
+            Expected number of items.
+          - error_rate (float): Default 0.001.
+            Probability of a false positive at the capacity.
+        """
+        capacity = max(capacity, 1)
+        self.size = ceil(-capacity * log(error_rate) / log(2) ** 2)
+        self.hashes = max(round(self.size / capacity * log(2)), 1)
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: str) -> list[int]:
+        # Double hashing: k positions from two 64-bit hashes.
+        digest = blake2b(item.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [
+            (first + i * second) % self.size for i in range(self.hashes)
+        ]
+
+    def add(self, item: str) -> None:
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(
+            self._bits[position >> 3] & 1 << (position & 7)
+            for position in self._positions(item)
+        )
+
+    def __len__(self) -> int:
+        return self.count
@@ -0,0 +1,163 @@
+import sys
+from collections import OrderedDict
+from time import monotonic
+from typing import Any, Hashable
+
+
+class LRUCache:
+    """A bounded in-process cache with LRU eviction and expiration.
+
+    Not thread-safe: it is meant to be used from the event loop only.
+    """
+    def __init__(self, maxsize: int, ttl: float | None = None) -> None:
+        """
+        #### Args:
+          - maxsize (int):
+            Maximum number of entries. If 0, the cache is disabled.
+          - ttl (float | None): Default None.
+            Lifetime of an entry in seconds. If None, entries live until
+            they are evicted.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[Hashable, tuple[Any, float | None]] = (
+            OrderedDict()
+        )
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Get a value and mark it as recently used.
+
+        #### Args:
+          - key (Hashable):
+            The key of the entry.
+          - default (Any): Default None.
+            Returned if the entry is missing or expired.
+
+        #### Returns:
+          - Any:
+            The cached value or `default`.
+        """
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+
+        value, expire_at = entry
+        if expire_at is not None and expire_at <= monotonic():
+            self._delete(key)
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None) -> None:
+        """Save a value, evicting the least recently used entries.
+
+        #### Args:
+          - key (Hashable):
+            The key of the entry.
+          - value (Any):
+            The value to save.
+          - ttl (float | None): Default None.
+            Lifetime of this entry, overrides the cache `ttl`.
+        """
+        if self.maxsize <= 0:
+            return
+
+        ttl = self.ttl if ttl is None else ttl
+        expire_at = None if ttl is None else monotonic() + ttl
+        self._data[key] = (value, expire_at)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._delete(next(iter(self._data)))
+
+    def _delete(self, key: Hashable) -> Any:
+        """Remove an existing entry and return its value.
+        """
+        return self._data.pop(key)[0]
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """Remove an entry.
+
+        #### Args:
+          - key (Hashable):
+            The key of the entry.
+
+        #### Returns:
+          - Any:
+            The removed value or `default`.
+        """
+        if key not in self._data:
+            return default
+        return self._delete(key)
+
+    def clear(self) -> None:
+        self._data.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self) -> dict[str, int]:
+        """Returns the counters of the cache.
+        """
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+class ByteLRUCache(LRUCache):
+    """An LRU cache of byte strings bounded by their total size.
+
+    `None` values are cached too, to remember negative results.
+    """
+    entry_overhead: int = 64
+
+    def __init__(self, max_bytes: int, ttl: float | None = None) -> None:
+        """
+        #### Args:
+          - max_bytes (int):
+            Maximum total size of the values. If 0, the cache is disabled.
+          - ttl (float | None): Default None.
+            Lifetime of an entry in seconds.
+        """
+        super().__init__(sys.maxsize if max_bytes > 0 else 0, ttl)
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._sizes: dict[Hashable, int] = {}
+
+    def set(
+        self, key: Hashable, value: bytes | None, ttl: float | None = None
+    ) -> None:
+        size = len(value or b'') + self.entry_overhead
+        if size > self.max_bytes:
+            return
+
+        self.pop(key)
+        super().set(key, value, ttl)
+        self._sizes[key] = size
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            self._delete(next(iter(self._data)))
+
+    def _delete(self, key: Hashable) -> Any:
+        self.bytes -= self._sizes.pop(key, 0)
+        return super()._delete(key)
+
+    def clear(self) -> None:
+        super().clear()
+        self._sizes.clear()
+        self.bytes = 0
+
+    def stats(self) -> dict[str, int]:
+        return super().stats() | {
+            'bytes': self.bytes, 'max_bytes': self.max_bytes
+        }
@@ -28,6 +28,15 @@ class NotActiveUserException(HTTPException):
         super().__init__(status_code, detail)
 
 
+class NotStaffUserException(HTTPException):
+    def __init__(
+        self,
+        status_code: int = status.HTTP_403_FORBIDDEN,
+        detail: str = 'The user is not staff',
+    ) -> None:
+        super().__init__(status_code, detail)
+
+
 class CredentialsException(HTTPException):
     def __init__(
         self,
@@ -54,3 +63,59 @@ class DbException(HTTPException):
         detail: str = 'Could not save these data'
     ) -> None:
         super().__init__(status_code, detail)
+
+
+class ServiceBusyException(HTTPException):
+    def __init__(
+        self,
+        status_code: int = status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail: str = 'The server is busy, try again later',
+        headers: dict[str, str] = {'Retry-After': '1'},
+    ) -> None:
+        super().__init__(status_code, detail, headers)
+
+
+class TooManyRequestsException(HTTPException):
+    def __init__(
+        self,
+        status_code: int = status.HTTP_429_TOO_MANY_REQUESTS,
+        detail: str = 'Too many attempts, try again later',
+        headers: dict[str, str] = {'Retry-After': '60'},
+    ) -> None:
+        super().__init__(status_code, detail, headers)
+
+
+class PayloadTooLargeException(HTTPException):
+    def __init__(
+        self,
+        status_code: int = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail: str = 'The uploaded file is too large',
+    ) -> None:
+        super().__init__(status_code, detail)
+
+
+class UnsupportedMediaTypeException(HTTPException):
+    def __init__(
+        self,
+        status_code: int = status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+        detail: str = 'Expected `multipart/form-data` or `image/*`',
+    ) -> None:
+        super().__init__(status_code, detail)
+
+
+class AvatarNotFoundException(HTTPException):
+    def __init__(
+        self,
+        status_code: int = status.HTTP_404_NOT_FOUND,
+        detail: str = 'Avatar not found',
+    ) -> None:
+        super().__init__(status_code, detail)
+
+
+class ProfileNotFoundException(HTTPException):
+    def __init__(
+        self,
+        status_code: int = status.HTTP_404_NOT_FOUND,
+        detail: str = 'Profile not found',
+    ) -> None:
+        super().__init__(status_code, detail)
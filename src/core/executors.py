@@ -0,0 +1,78 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor
+from functools import partial
+from typing import Any, Callable
+
+from src.core.exceptions import ServiceBusyException
+
+
+class BoundedProcessPool:
+    """A lazily started process pool with a limited queue of pending jobs.
+
+    CPU-bound work (hashing, image processing) is sent to worker processes
+    so the event loop keeps serving requests. When more than
+    `max_workers + max_queue` jobs are pending, new jobs are rejected
+    instead of piling up behind the busy workers.
+    """
+    def __init__(self, max_workers: int, max_queue: int) -> None:
+        """
+        #### Args:
+          - max_workers (int):
+            Number of worker processes. If 0, jobs run in the default
+            thread pool of the event loop.
+          - max_queue (int):
+            How many jobs may wait for a free worker.
+        """
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.pending = 0
+        self._executor: Executor | None = None
+
+    @property
+    def limit(self) -> int:
+        return max(self.max_workers, 1) + self.max_queue
+
+    def _get_executor(self) -> Executor | None:
+        if self.max_workers <= 0:
+            return None
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+        return self._executor
+
+    async def run(self, func: Callable, *args: Any, **kwargs: Any) -> Any:
+        """Run `func(*args, **kwargs)` in the pool and wait for the result.
+
+        #### Args:
+          - func (Callable):
+            A module-level (picklable) function.
+
+        #### Raises:
+          - ServiceBusyException:
+            The queue of pending jobs is full.
+
+        #### Returns:
+          - Any:
+            The result of the function.
+        """
+        if self.pending >= self.limit:
+            raise ServiceBusyException
+
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self._get_executor(), partial(func, *args, **kwargs)
+            )
+        finally:
+            self.pending -= 1
+
+    def shutdown(self) -> None:
+        """Stop the worker processes. The pool restarts on the next job.
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,236 @@
+"""Metrics in the Prometheus text format.
+
+A small in-process implementation: updating a metric is a dict lookup
+and an addition, rendering happens only when `/metrics` is scraped.
+"""
+from bisect import bisect_left
+from time import perf_counter
+from typing import Callable, Iterable
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from src.core.cache import LRUCache
+
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10
+)
+
+
+def format_labels(names: tuple[str, ...], values: tuple[str, ...]) -> str:
+    if not names:
+        return ''
+    pairs = ','.join(
+        '%s="%s"' % (name, str(value).replace('\\', r'\\').replace(
+            '"', r'\"'
+        ).replace('\n', r'\n'))
+        for name, value in zip(names, values)
+    )
+    return '{%s}' % pairs
+
+
+class Metric:
+    """A metric with a fixed set of label names.
+    """
+    type = ''
+
+    def __init__(
+        self, name: str, documentation: str, labels: tuple[str, ...] = ()
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.label_names = labels
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def render(self) -> Iterable[str]:
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} {self.type}'
+        for labels, value in list(self._values.items()):
+            yield (
+                f'{self.name}{format_labels(self.label_names, labels)} '
+                f'{value}'
+            )
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels: str, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) - amount
+
+    def set(self, *labels: str, value: float) -> None:
+        self._values[labels] = value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labels)
+        self.buckets = buckets
+        # Counts of every bucket (not cumulative), `+Inf` last, and sum.
+        self._series: dict[
+            tuple[str, ...], tuple[list[int], list[float]]
+        ] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = (
+                [0] * (len(self.buckets) + 1), [0.0]
+            )
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1][0] += value
+
+    def render(self) -> Iterable[str]:
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} {self.type}'
+        label_names = self.label_names + ('le',)
+        for labels, (counts, total) in list(self._series.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += count
+                yield (
+                    f'{self.name}_bucket'
+                    f'{format_labels(label_names, (*labels, bound))} '
+                    f'{cumulative}'
+                )
+            suffix = format_labels(self.label_names, labels)
+            yield f'{self.name}_sum{suffix} {total[0]}'
+            yield f'{self.name}_count{suffix} {cumulative}'
+
+
+class Registry:
+    """Metrics to render and collectors which update them on a scrape.
+    """
+    def __init__(self) -> None:
+        self.metrics: list[Metric] = []
+        self.collectors: list[Callable[[], None]] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        for collect in self.collectors:
+            collect()
+        return '\n'.join(
+            line for metric in self.metrics for line in metric.render()
+        ) + '\n'
+
+
+registry = Registry()
+
+REQUESTS_IN_FLIGHT = registry.register(Gauge(
+    'http_requests_in_flight', 'Requests being processed.'
+))
+REQUEST_DURATION = registry.register(Histogram(
+    'http_request_duration_seconds',
+    'Duration of requests by route.',
+    ('method', 'route', 'status'),
+))
+PASSWORD_HASH_DURATION = registry.register(Histogram(
+    'password_hash_duration_seconds',
+    'Duration of password hashing and verification, with waiting '
+    'for the pool.',
+    ('operation',),
+))
+DB_QUERIES = registry.register(Counter(
+    'db_queries_total', 'Executed SQL statements.', ('statement',)
+))
+DB_QUERY_DURATION = registry.register(Histogram(
+    'db_query_duration_seconds',
+    'Duration of SQL statements.',
+    ('statement',),
+    (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1),
+))
+AVATAR_STAGE_DURATION = registry.register(Histogram(
+    'avatar_stage_duration_seconds',
+    'Duration of the stages of the avatar pipeline.',
+    ('stage',),
+))
+CACHE_HITS = registry.register(Gauge(
+    'cache_hits', 'Hits of in-memory caches.', ('cache',)
+))
+CACHE_MISSES = registry.register(Gauge(
+    'cache_misses', 'Misses of in-memory caches.', ('cache',)
+))
+CACHE_HIT_RATIO = registry.register(Gauge(
+    'cache_hit_ratio', 'Hits of in-memory caches per lookup.', ('cache',)
+))
+CACHE_SIZE = registry.register(Gauge(
+    'cache_size', 'Entries of in-memory caches.', ('cache',)
+))
+
+
+def register_caches(caches: dict[str, LRUCache]) -> None:
+    """Report the counters of the caches on every scrape.
+
+    #### Args:
+      - caches (dict[str, LRUCache]):
+        Caches by the name used as the label.
+    """
+    def collect() -> None:
+        for name, cache in caches.items():
+            lookups = cache.hits + cache.misses
+            CACHE_HITS.set(name, value=cache.hits)
+            CACHE_MISSES.set(name, value=cache.misses)
+            CACHE_HIT_RATIO.set(
+                name, value=cache.hits / lookups if lookups else 0
+            )
+            CACHE_SIZE.set(name, value=len(cache))
+
+    registry.collectors.append(collect)
+
+
+class MetricsMiddleware:
+    """Measure the requests by the path template of the matched route.
+
+    A pure ASGI middleware, so it does not wrap the response body.
+    """
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(
+        self, scope: Scope, receive: Receive, send: Send
+    ) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_status(message: Message) -> None:
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc()
+        start = perf_counter()
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+            route = scope.get('route')
+            REQUEST_DURATION.observe(
+                perf_counter() - start,
+                scope['method'],
+                getattr(route, 'path', '<unmatched>'),
+                str(status),
+            )
@@ -0,0 +1,105 @@
+"""Move the avatars of the old layout into the storage of avatars.
+
+Before, every user had the directory `AVATARS_DIR/<id>/` with
+`original.png` and the resized `png` files. Run from the root of the
+project once after the upgrade:
+
+    python -m src.core.migrate_avatars [--keep]
+
+Every original is stored by the digest of its pixels, linked to the user
+and resized, then the old directory is removed unless `--keep` is given.
+Users who already have an avatar in the new layout are skipped.
+"""
+import argparse
+import asyncio
+import logging
+import shutil
+from pathlib import Path
+
+from src.config import AVATAR_SIZES, AVATARS_DIR
+from src.core.services import Avatar, avatar_pool, avatar_storage
+from src.core.storage import Storage
+
+logger = logging.getLogger(__name__)
+
+# The first existing file is the source of the avatar.
+LEGACY_FILES = ['original.png'] + [
+    f'{width}.png' for width, _ in sorted(AVATAR_SIZES, reverse=True)
+]
+
+
+def legacy_avatars(legacy_dir: Path) -> list[tuple[str, Path]]:
+    """Find the avatars of the old layout.
+
+    #### Args:
+      - legacy_dir (Path):
+        The directory with a subdirectory for every user.
+
+    #### Returns:
+      - list[tuple[str, Path]]:
+        User ID and the image file of every found avatar.
+    """
+    avatars = []
+    if not legacy_dir.is_dir():
+        return avatars
+
+    for user_dir in sorted(legacy_dir.iterdir()):
+        if not user_dir.is_dir() or not user_dir.name.isdigit():
+            continue
+        for name in LEGACY_FILES:
+            if (user_dir / name).is_file():
+                avatars.append((user_dir.name, user_dir / name))
+                break
+    return avatars
+
+
+async def migrate_avatars(
+    legacy_dir: Path, storage: Storage, keep: bool = False
+) -> int:
+    """Store and link the avatars of the old layout.
+
+    #### Args:
+      - legacy_dir (Path):
+        The directory with a subdirectory for every user.
+      - storage (Storage):
+        Storage of avatars.
+      - keep (bool): Default False.
+        Keep the old directories.
+
+    #### Returns:
+      - int:
+        Number of migrated avatars.
+    """
+    migrated = 0
+    for user_id, image_file in legacy_avatars(legacy_dir):
+        if await Avatar.get_digest(storage, user_id) is None:
+            avatar = await Avatar(None, user_id, storage, image_file)
+            if avatar.image is None:
+                logger.warning('Avatar %s is not an image', image_file)
+                continue
+            await avatar.save_resized_avatars()
+            migrated += 1
+        if not keep:
+            shutil.rmtree(image_file.parent)
+    return migrated
+
+
+async def run(keep: bool) -> int:
+    try:
+        return await migrate_avatars(AVATARS_DIR, avatar_storage, keep)
+    finally:
+        avatar_pool.shutdown()
+        await avatar_storage.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        '--keep', action='store_true', help='keep the old directories'
+    )
+    args = parser.parse_args()
+    print(f'Migrated avatars: {asyncio.run(run(args.keep))}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+import cProfile
+import hmac
+import random
+import re
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from uuid import uuid4
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from src.config import settings
+
+PROFILE_HEADER = 'x-profile'
+PROFILE_NAME_RE = re.compile(r'^[\w.-]+\.pstats$')
+
+
+@dataclass(frozen=True, slots=True)
+class ProfileInfo:
+    """A saved profile.
+    """
+    name: str
+    size: int
+    created: datetime
+
+
+def list_profiles(directory: Path) -> list[ProfileInfo]:
+    """Get the saved profiles, the newest first.
+    """
+    profiles = []
+    for path in directory.glob('*.pstats'):
+        stat = path.stat()
+        profiles.append(ProfileInfo(
+            path.name,
+            stat.st_size,
+            datetime.fromtimestamp(stat.st_mtime, timezone.utc),
+        ))
+    return sorted(profiles, key=lambda profile: profile.name, reverse=True)
+
+
+def profile_path(directory: Path, name: str) -> Path | None:
+    """Get the path of the saved profile if it exists.
+    """
+    if not PROFILE_NAME_RE.match(name):
+        return None
+    path = directory / name
+    return path if path.is_file() else None
+
+
+def save_profile(
+    profile: cProfile.Profile, directory: Path, name: str, keep: int
+) -> None:
+    """Save the profile and remove the oldest ones over `keep`.
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    profile.dump_stats(directory / name)
+    for path in sorted(directory.glob('*.pstats'))[:-max(keep, 1)]:
+        path.unlink(missing_ok=True)
+
+
+class ProfilingMiddleware:
+    """Profile requests with `cProfile` and save them as `pstats` files.
+
+    A request is profiled if its `X-Profile` header matches
+    `settings.profiling_token` or it is in the random
+    `settings.profiling_sample_rate` of requests. One request is
+    profiled at a time: the profiler sees the whole event loop,
+    so concurrent requests are included into the profile too.
+    The name of the saved file is returned in `X-Profile-Id`.
+    """
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+        self._active = False
+
+    def _wanted(self, scope: Scope) -> bool:
+        if settings.profiling_token:
+            header = Headers(scope=scope).get(PROFILE_HEADER)
+            # Bytes, `compare_digest` rejects non-ASCII strings.
+            if header is not None and hmac.compare_digest(
+                header.encode(), settings.profiling_token.encode()
+            ):
+                return True
+        return random.random() < settings.profiling_sample_rate
+
+    async def __call__(
+        self, scope: Scope, receive: Receive, send: Send
+    ) -> None:
+        if scope['type'] != 'http' or self._active or not self._wanted(
+            scope
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        slug = re.sub(r'\W+', '_', scope['path']).strip('_')[:40]
+        name = '%s-%s-%s-%s.pstats' % (
+            datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%f'),
+            scope['method'],
+            slug or 'root',
+            uuid4().hex[:8],
+        )
+
+        async def send_with_id(message: Message) -> None:
+            if message['type'] == 'http.response.start':
+                message['headers'] = [
+                    *message.get('headers', []),
+                    (b'x-profile-id', name.encode()),
+                ]
+            await send(message)
+
+        self._active = True
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            profile.disable()
+            self._active = False
+            await run_in_threadpool(
+                save_profile,
+                profile,
+                settings.profiles_dir,
+                name,
+                settings.profiling_keep,
+            )
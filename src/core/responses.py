@@ -0,0 +1,176 @@
+from email.utils import formatdate, parsedate_to_datetime
+
+from fastapi import Request, Response, status
+from fastapi.responses import FileResponse, StreamingResponse
+
+from src.core.storage import ObjectStat, Storage
+
+
+def accepted_quality(accept: str, media_type: str) -> float:
+    """Get the quality of the media type from the `Accept` header.
+
+    The most specific media range of the header wins.
+
+    #### Args:
+      - accept (str):
+        The value of the `Accept` header.
+      - media_type (str):
+        The offered media type, like `image/webp`.
+
+    #### Returns:
+      - float:
+        The quality from 0 (not acceptable) to 1.
+    """
+    main_type = media_type.split('/')[0]
+    specificity, quality = -1, 0.0
+    for media_range in accept.lower().split(','):
+        name, *params = (part.strip() for part in media_range.split(';'))
+        if name == media_type:
+            current = 2
+        elif name == main_type + '/*':
+            current = 1
+        elif name == '*/*':
+            current = 0
+        else:
+            continue
+        if current <= specificity:
+            continue
+
+        specificity, quality = current, 1.0
+        for param in params:
+            key, _, value = param.partition('=')
+            if key.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+
+    return quality
+
+
+def is_not_modified(request: Request, stat: ObjectStat) -> bool:
+    """Check the conditional headers of the request.
+
+    #### Args:
+      - request (Request):
+        The request.
+      - stat (ObjectStat):
+        The metadata of the current version of the resource.
+
+    #### Returns:
+      - bool:
+        The client has the current version of the resource.
+    """
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match is not None:
+        tags = {
+            tag.strip().removeprefix('W/') for tag in if_none_match.split(',')
+        }
+        return '*' in tags or stat.etag in tags
+
+    if_modified_since = request.headers.get('if-modified-since')
+    if if_modified_since is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return int(stat.mtime) <= since
+
+    return False
+
+
+def cache_headers(stat: ObjectStat, max_age: int) -> dict[str, str]:
+    """Get the headers which let clients cache and revalidate a resource.
+    """
+    return {
+        'ETag': stat.etag,
+        'Last-Modified': formatdate(stat.mtime, usegmt=True),
+        'Cache-Control': f'public, max-age={max_age}',
+    }
+
+
+def cached_content_response(
+    request: Request,
+    content: bytes,
+    stat: ObjectStat,
+    media_type: str,
+    max_age: int,
+) -> Response:
+    """Make a response with content in memory which can be cached by clients.
+
+    #### Args:
+      - request (Request):
+        The request.
+      - content (bytes):
+        The body of the response.
+      - stat (ObjectStat):
+        The metadata of the content.
+      - media_type (str):
+        The media type of the content.
+      - max_age (int):
+        How long clients may use the content without revalidation, seconds.
+
+    #### Returns:
+      - Response:
+        The content or `304 Not Modified`.
+    """
+    headers = cache_headers(stat, max_age)
+    if is_not_modified(request, stat):
+        return Response(
+            status_code=status.HTTP_304_NOT_MODIFIED, headers=headers
+        )
+    return Response(content, headers=headers, media_type=media_type)
+
+
+def cached_object_response(
+    request: Request,
+    storage: Storage,
+    key: str,
+    stat: ObjectStat,
+    media_type: str,
+    max_age: int,
+    headers: dict[str, str] | None = None,
+) -> Response:
+    """Make a response with the stored object which can be cached by clients.
+
+    Objects on the local disk are sent as files, others are streamed
+    from the storage.
+
+    #### Args:
+      - request (Request):
+        The request.
+      - storage (Storage):
+        The storage of the object.
+      - key (str):
+        The key of the object.
+      - stat (ObjectStat):
+        The metadata of the object.
+      - media_type (str):
+        The media type of the object.
+      - max_age (int):
+        How long clients may use the object without revalidation, seconds.
+      - headers (dict[str, str] | None): Default None.
+        Additional headers of the response.
+
+    #### Returns:
+      - Response:
+        The object or `304 Not Modified`.
+    """
+    headers = (headers or {}) | cache_headers(stat, max_age)
+    if is_not_modified(request, stat):
+        return Response(
+            status_code=status.HTTP_304_NOT_MODIFIED, headers=headers
+        )
+
+    path = storage.local_path(key)
+    if path is not None:
+        return FileResponse(
+            path, headers=headers, media_type=media_type, method=request.method
+        )
+
+    headers['Content-Length'] = str(stat.size)
+    if request.method == 'HEAD':
+        return Response(headers=headers, media_type=media_type)
+    return StreamingResponse(
+        storage.stream(key), headers=headers, media_type=media_type
+    )
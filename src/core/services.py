@@ -1,89 +1,412 @@
+import asyncio
 import base64
+import hashlib
 import io
+import logging
 from binascii import Error as BinError
+from collections import Counter
 from pathlib import Path
+from time import perf_counter
 
 from asyncinit import asyncinit
 from PIL import Image, UnidentifiedImageError
+from starlette.concurrency import run_in_threadpool
 
-from src.config import AVATAR_SIZES, AVATARS_DIR
+from src.config import (
+    AVATAR_FORMATS,
+    AVATAR_QUALITY,
+    AVATAR_SIZES,
+    AVATARS_DIR,
+    settings,
+)
+from src.core.cache import ByteLRUCache
+from src.core.executors import BoundedProcessPool
+from src.core.metrics import AVATAR_STAGE_DURATION
+from src.core.responses import accepted_quality
+from src.core.storage import (
+    LocalStorage,
+    ObjectStat,
+    S3Storage,
+    Storage,
+    file_digest,
+)
+
+logger = logging.getLogger(__name__)
+
+avatar_pool = BoundedProcessPool(
+    settings.avatar_pool_size, settings.avatar_queue_size
+)
+avatar_cache = ByteLRUCache(
+    settings.avatar_cache_bytes, settings.avatar_cache_ttl
+)
+
+CONTENT_DIR = 'content'  # avatars by digest of their pixels
+ALIASES_DIR = 'aliases'  # digest of pixels by digest of uploaded bytes
+USERS_DIR = 'users'  # digest of the avatar of every user
+REFS_DIR = 'refs'  # an object for every user linked to the avatar
+ORIGINAL = 'original.png'
+RESIZED = '.resized'  # marks avatars whose variants are all saved
+
+# Reference counting is guarded in this process only: `_links_lock`
+# orders links and unlinks, `_storing` keeps the content uploaded but not
+# linked yet. Workers sharing the storage may race and delete content
+# another worker has just linked, so they must disable
+# `settings.avatar_delete_unreferenced`.
+_links_lock = asyncio.Lock()
+_storing: Counter[str] = Counter()
+
+
+def _pixels_digest(image: Image.Image) -> str:
+    """Get the digest of the decoded pixels of the image.
+
+    The same picture gives the same digest regardless of the file format
+    and metadata.
+    """
+    normalized = image.convert('RGBA')
+    digest = hashlib.sha256(str(normalized.size).encode())
+    digest.update(normalized.tobytes())
+    return digest.hexdigest()
+
+
+def decode_avatar(
+    raw: bytes | None, image_file: str | None = None
+) -> tuple[str, bytes] | None:
+    """Decode an image and encode it as `png`.
+
+    Runs in a worker process.
+
+    #### Args:
+      - raw (bytes | None):
+        The content of the image file.
+      - image_file (str | None): Default None.
+        Path to the uploaded image, used instead of `raw`.
+
+    #### Returns:
+      - tuple[str, bytes] | None:
+        The digest of the pixels and the `png` image or None
+        if the data is incorrect.
+    """
+    try:
+        image = Image.open(image_file or io.BytesIO(raw))
+        image.load()
+    except (UnidentifiedImageError, OSError):
+        return None
+
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return _pixels_digest(image), buffer.getvalue()
+
+
+def _load_image_plugins() -> None:
+    """Register optional Pillow plugins.
+    """
+    try:
+        import pillow_avif  # noqa: F401
+    except ImportError:
+        pass
+
+
+def _encode_variants(
+    image: Image.Image,
+    width: int,
+    quality: dict[str, int],
+    timings: dict[str, float],
+) -> dict[str, bytes]:
+    """Encode the image in every supported format.
+
+    #### Returns:
+      - dict[str, bytes]:
+        Encoded images by file name.
+    """
+    variants = {}
+    extensions = Image.registered_extensions()
+    for ext in AVATAR_FORMATS:
+        if ext != 'png' and (
+            ext not in quality or extensions.get('.' + ext) not in Image.SAVE
+        ):
+            continue
+
+        options = {} if ext == 'png' else {'quality': quality[ext]}
+        name = f'{width}.{ext}'
+        start = perf_counter()
+        buffer = io.BytesIO()
+        image.save(buffer, format=extensions['.' + ext], **options)
+        variants[name] = buffer.getvalue()
+        timings[f'encode_{name}'] = perf_counter() - start
+
+    return variants
+
+
+def resize_avatars(
+    original: bytes,
+    sizes: list[tuple[int, int]],
+    quality: dict[int, dict[str, int]],
+) -> tuple[dict[str, float], dict[str, bytes]]:
+    """Decode the image once and encode it with every size and format.
+
+    Each size is made from the previous one, from the largest size
+    to the smallest. Runs in a worker process.
+
+    #### Args:
+      - original (bytes):
+        The original image.
+      - sizes (list[tuple[int, int]]):
+        Sizes for the new images.
+      - quality (dict[int, dict[str, int]]):
+        Quality of the lossy formats for every width.
+
+    #### Returns:
+      - tuple[dict[str, float], dict[str, bytes]]:
+        Duration of every stage in seconds and the encoded images
+        by file name.
+    """
+    _load_image_plugins()
+    timings = {}
+    variants = {}
+    start = perf_counter()
+    image = Image.open(io.BytesIO(original))
+    image.load()
+    timings['decode'] = perf_counter() - start
+
+    for size in sorted(sizes, key=lambda size: size[0] * size[1])[::-1]:
+        start = perf_counter()
+        image.thumbnail(size)
+        timings[f'resize_{size[0]}'] = perf_counter() - start
+
+        variants |= _encode_variants(
+            image, size[0], quality.get(size[0], {}), timings
+        )
+
+    return timings, variants
+
+
+def _decode_base64(base64_data: bytes) -> tuple[bytes, str] | None:
+    try:
+        raw = base64.b64decode(base64_data)
+    except BinError:
+        return None
+    return raw, hashlib.sha256(raw).hexdigest()
+
+
+def content_key(digest: str, name: str) -> str:
+    """Returns the storage key of a file of the stored avatar.
+    """
+    return f'{CONTENT_DIR}/{digest}/{name}'
 
 
 @asyncinit
 class Avatar:
     """Managing user avatars.
+
+    Avatars are stored once by the digest of their pixels,
+    users refer to them by the digest.
     """
     sizes: list[tuple[int, int]] = AVATAR_SIZES
+    widths: set[int] = {size[0] for size in AVATAR_SIZES}
     min_size_avatar: str = str(min(AVATAR_SIZES)[0]) + '.png'
-    save_dir: Path
-    image: Path | None
+    storage: Storage
+    user_id: str
+    image: str | None
+    digest: str
+    resized: bool
+    timings: dict[str, float]
+    savings: dict[str, int]
 
     async def __init__(
-        self, base64_data: bytes, user_id: str, avatars_dir: Path
+        self,
+        base64_data: bytes | None,
+        user_id: str,
+        storage: Storage,
+        image_file: Path | None = None,
     ) -> None:
-        self.__set_save_dir(avatars_dir, user_id)
-        self.image = await self.base64_to_image(base64_data)
+        self.storage = storage
+        self.user_id = user_id
+        self._original: bytes | None = None
+        self._storing: str | None = None
+        try:
+            self.image = await self.base64_to_image(base64_data, image_file)
+            if self.image is not None:
+                await self.link(storage, user_id, self.digest)
+        finally:
+            if self._storing is not None:
+                _storing[self._storing] -= 1
+                if not _storing[self._storing]:
+                    del _storing[self._storing]
 
-    def __set_save_dir(self, avatars_dir: Path, user_id: str) -> None:
-        """Set attr `self.save_dir`.
+    async def base64_to_image(
+        self, base64_data: bytes | None, image_file: Path | None = None
+    ) -> str | None:
+        """Convert and save binary data (`base64`) to an image(`png`).
+
+        If the same bytes were uploaded before, the image is not decoded.
+        If the same picture is stored, it is neither saved nor resized.
 
         #### Args:
-          - avatars_dir (Path):
-            Shared directory for storing avatars.
-          - user_id (str):
-            A unique user ID to create a unique directory.
-            for saving user avatars.
+          - base64_data (bytes | None):
+            The image is in the `base64` format.
+          - image_file (Path | None): Default None.
+            The uploaded image file, used instead of `base64_data`.
+
+        #### Returns:
+          - str | None:
+            The storage key of the saved image or None if data is incorrect.
         """
-        self.save_dir = avatars_dir / user_id
-        self.save_dir.mkdir(exist_ok=True)
+        raw = None
+        if image_file is not None:
+            image_file = str(image_file)
+            raw_digest = await run_in_threadpool(file_digest, image_file)
+        else:
+            decoded = await run_in_threadpool(_decode_base64, base64_data)
+            if decoded is None:
+                return None
+            raw, raw_digest = decoded
 
-    async def base64_to_image(self, base64_data: bytes) -> Path | None:
-        """Convert and save binary data (`base64`) to an image(`png`).
+        alias_key = f'{ALIASES_DIR}/{raw_digest}'
+        alias = await self.storage.get(alias_key)
+        if alias is not None and await self.storage.stat(
+            content_key(alias.decode(), ORIGINAL)
+        ) is not None:
+            self.digest = alias.decode()
+            self._mark_storing()
+        else:
+            result = await avatar_pool.run(decode_avatar, raw, image_file)
+            if result is None:
+                return None
 
-        #### Args:
-          - base64_data (bytes):
-            The image is in the `base64` format.
+            self.digest, self._original = result
+            self._mark_storing()
+            original_key = content_key(self.digest, ORIGINAL)
+            if await self.storage.stat(original_key) is None:
+                await self.storage.put(original_key, self._original)
+            await self.storage.put(alias_key, self.digest.encode())
+
+        self.resized = await self.storage.stat(
+            content_key(self.digest, RESIZED)
+        ) is not None
+        return content_key(self.digest, ORIGINAL)
+
+    def _mark_storing(self) -> None:
+        # Not deleted by `_unref` until it is linked to the user.
+        self._storing = self.digest
+        _storing[self.digest] += 1
+
+    async def save_resized_avatars(self) -> dict[str, float]:
+        """Save the image with different sizes and formats.
+
+        Sets `self.savings`: how many bytes every variant saves
+        compared to `png` of the same size.
 
         #### Returns:
-          - Path | None:
-            The path to the saved image or None if data is incorrect.
+          - dict[str, float]:
+            Duration of every stage of the pipeline in seconds.
         """
-        try:
-            image = Image.open(io.BytesIO(base64.b64decode(base64_data)))
-        except (BinError, UnidentifiedImageError):
-            return None
+        if self.resized:
+            self.timings, self.savings = {}, {}
+            return self.timings
 
-        image_name = self.save_dir / 'original.png'
-        image.save(image_name)
-        return image_name
+        original = self._original or await self.storage.get(self.image)
+        self.timings, variants = await avatar_pool.run(
+            resize_avatars, original, self.sizes, AVATAR_QUALITY
+        )
+        start = perf_counter()
+        for name, data in variants.items():
+            await self.storage.put(content_key(self.digest, name), data)
+        await self.storage.put(content_key(self.digest, RESIZED), b'')
+        self.timings['store'] = perf_counter() - start
+        for stage, seconds in self.timings.items():
+            AVATAR_STAGE_DURATION.observe(seconds, stage)
 
-    async def _save_resized_image(self, size: tuple[int, int]) -> None:
-        """Resize the image and save it.
+        self.savings = {
+            name: len(variants[name.split('.')[0] + '.png']) - len(data)
+            for name, data in variants.items()
+            if not name.endswith('.png')
+        }
+        self._original = None
+        self.resized = True
+        avatar_cache.pop(self.user_id)
+        logger.debug(
+            'Avatars %s resized: %s, bytes saved: %s',
+            self.digest, self.timings, self.savings,
+        )
+        return self.timings
+
+    @staticmethod
+    async def get_digest(storage: Storage, user_id: str) -> str | None:
+        """Returns the digest of the avatar of the user if it exists.
+        """
+        digest = await storage.get(f'{USERS_DIR}/{user_id}')
+        return None if digest is None else digest.decode()
+
+    @classmethod
+    async def link(cls, storage: Storage, user_id: str, digest: str) -> None:
+        """Link the user to the stored avatar.
+
+        The avatar which was linked before is deleted if no other user
+        refers to it and `settings.avatar_delete_unreferenced` is set.
 
         #### Args:
-          - size (tuple[int, int]):
-            Size for the new image.
+          - storage (Storage):
+            Storage of avatars.
+          - user_id (str):
+            Unique user ID.
+          - digest (str):
+            The digest of the stored avatar.
         """
-        resized_image = Image.open(self.image)
-        resized_image.thumbnail(size)
-        image_name = self.save_dir / (str(size[0]) + '.png')
-        resized_image.save(image_name)
+        async with _links_lock:
+            await storage.put(
+                content_key(digest, f'{REFS_DIR}/{user_id}'), b''
+            )
+            old_digest = await cls.get_digest(storage, user_id)
+            await storage.put(f'{USERS_DIR}/{user_id}', digest.encode())
+            if old_digest not in (None, digest):
+                await cls._unref(storage, old_digest, user_id)
+        avatar_cache.pop(user_id)
 
-    async def save_resized_avatars(self) -> None:
-        """Save the image with different sizes.
+    @classmethod
+    async def delete(cls, storage: Storage, user_id: str) -> None:
+        """Unlink the avatar from the user.
+
+        The stored avatar is deleted if no other user refers to it
+        and `settings.avatar_delete_unreferenced` is set.
+
+        #### Args:
+          - storage (Storage):
+            Storage of avatars.
+          - user_id (str):
+            Unique user ID.
         """
-        for size in self.sizes:
-            await self._save_resized_image(size)
+        async with _links_lock:
+            digest = await cls.get_digest(storage, user_id)
+            await storage.delete(f'{USERS_DIR}/{user_id}')
+            if digest is not None:
+                await cls._unref(storage, digest, user_id)
+        avatar_cache.pop(user_id)
+
+    @staticmethod
+    async def _unref(storage: Storage, digest: str, user_id: str) -> None:
+        await storage.delete(content_key(digest, f'{REFS_DIR}/{user_id}'))
+        if not settings.avatar_delete_unreferenced or _storing[digest]:
+            return
+        if await storage.list(content_key(digest, REFS_DIR + '/')):
+            return
+
+        for key in await storage.list(content_key(digest, '')):
+            await storage.delete(key)
 
     @classmethod
     async def base64_min_avatar(
-        cls, avatars_dir: Path, user_id: str
+        cls, storage: Storage, user_id: str
     ) -> bytes | None:
         """Returns the minimum avatar as `base64` if it exists.
 
+        Results are kept in `avatar_cache` until the avatar of the user
+        changes or `settings.avatar_cache_ttl` passes, missing avatars
+        for `settings.avatar_cache_miss_ttl`. The expiry bounds how long
+        changes made by other workers stay unseen.
+
         #### Args:
-          - avatars_dir (Path):
-            Shared directory for storing avatars.
+          - storage (Storage):
+            Storage of avatars.
           - user_id (str):
             Unique user ID for avatar search.
 
@@ -91,19 +414,94 @@ class Avatar:
           - bytes | None:
             Avatar as base64 if it exists.
         """
-        avatar = avatars_dir / user_id / cls.min_size_avatar
-        if not avatar.exists():
+        encoded = avatar_cache.get(user_id, default=...)
+        if encoded is not ...:
+            return encoded
+
+        encoded = None
+        digest = await cls.get_digest(storage, user_id)
+        if digest is not None:
+            avatar = await storage.get(
+                content_key(digest, cls.min_size_avatar)
+            )
+            if avatar is not None:
+                encoded = base64.b64encode(avatar)
+        ttl = settings.avatar_cache_miss_ttl if encoded is None else None
+        avatar_cache.set(user_id, encoded, ttl)
+        return encoded
+
+    @classmethod
+    async def select_variant(
+        cls, storage: Storage, user_id: str, width: int, accept: str | None
+    ) -> tuple[str, ObjectStat, str] | None:
+        """Find the smallest avatar in a format the client accepts.
+
+        Without the `Accept` header only `png` is offered, as it was
+        the only format before.
+
+        #### Args:
+          - storage (Storage):
+            Storage of avatars.
+          - user_id (str):
+            Unique user ID for avatar search.
+          - width (int):
+            Width of the avatar.
+          - accept (str | None):
+            The `Accept` header of the request.
+
+        #### Returns:
+          - tuple[str, ObjectStat, str] | None:
+            The storage key, metadata and media type if the avatar exists.
+        """
+        digest = await cls.get_digest(storage, user_id)
+        if digest is None:
+            return None
+
+        keys = [
+            content_key(digest, f'{width}.{ext}')
+            for ext, media_type in AVATAR_FORMATS.items()
+            if ext == 'png' or (
+                accept is not None and accepted_quality(accept, media_type)
+            )
+        ]
+        stats = await asyncio.gather(*(storage.stat(key) for key in keys))
+        found = [
+            (stat.size, key, stat)
+            for key, stat in zip(keys, stats) if stat is not None
+        ]
+        if not found:
             return None
 
-        with open(avatar, 'rb') as img:
-            return base64.b64encode(img.read())
+        _, key, stat = min(found)
+        return key, stat, AVATAR_FORMATS[key.rsplit('.', 1)[1]]
+
+
+def create_avatar_storage() -> Storage:
+    """Create the storage of avatars selected in the settings.
+
+    #### Returns:
+      - Storage:
+        The local storage or the S3 bucket.
+    """
+    if settings.avatar_storage == 's3':
+        return S3Storage(
+            endpoint_url=settings.s3_endpoint_url,
+            bucket=settings.s3_bucket,
+            access_key=settings.s3_access_key,
+            secret_key=settings.s3_secret_key,
+            region=settings.s3_region,
+        )
+    return LocalStorage(AVATARS_DIR)
+
+
+avatar_storage = create_avatar_storage()
 
 
-def get_avatars_root() -> Path:
-    """Returns the path to the avatars directory to use depending on.
+def get_avatar_storage() -> Storage:
+    """Returns the storage of avatars to use depending on the settings.
 
     #### Returns:
-      - Path:
-        The path to the avatars directory.
+      - Storage:
+        The storage of avatars.
     """
-    return AVATARS_DIR
+    return avatar_storage
@@ -0,0 +1,359 @@
+import hashlib
+import hmac
+import os
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from typing import AsyncIterator
+from urllib.parse import quote
+from uuid import uuid4
+from xml.etree import ElementTree
+
+import httpx
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+
+from src.core.cache import LRUCache
+
+CHUNK_SIZE = 64 * 1024
+
+
+@dataclass(frozen=True, slots=True)
+class ObjectStat:
+    """Metadata of a stored object.
+    """
+    size: int
+    mtime: float
+    etag: str  # quoted strong `ETag`
+
+
+class Storage(ABC):
+    """Async storage of binary objects by string keys like `a/b/c.png`.
+    """
+    @abstractmethod
+    async def put(self, key: str, data: bytes) -> None:
+        """Save the object, replacing the existing one.
+        """
+
+    @abstractmethod
+    async def get(self, key: str) -> bytes | None:
+        """Returns the content of the object or None if it does not exist.
+        """
+
+    @abstractmethod
+    async def stat(self, key: str) -> ObjectStat | None:
+        """Returns the metadata of the object or None if it does not exist.
+        """
+
+    @abstractmethod
+    async def delete(self, key: str) -> None:
+        """Delete the object if it exists.
+        """
+
+    @abstractmethod
+    def stream(
+        self, key: str, chunk_size: int = CHUNK_SIZE
+    ) -> AsyncIterator[bytes]:
+        """Iterate over the content of an existing object.
+        """
+
+    @abstractmethod
+    async def list(self, prefix: str) -> list[str]:
+        """Returns the keys which start with the prefix.
+        """
+
+    def local_path(self, key: str) -> Path | None:
+        """Returns the path of the object on the local disk if there is one.
+        """
+        return None
+
+    async def close(self) -> None:
+        """Release the resources of the storage.
+        """
+
+
+def file_digest(path: str | os.PathLike) -> str:
+    """Get `sha256` of the file content without reading it into memory.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        while chunk := file.read(CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class LocalStorage(Storage):
+    """Storage in a directory of the local disk.
+
+    File operations run in the thread pool, not on the event loop.
+    """
+    etag_cache = LRUCache(maxsize=4096)
+
+    def __init__(self, root: Path) -> None:
+        self.root = root
+
+    def _path(self, key: str) -> Path:
+        path = (self.root / key).resolve()
+        if not path.is_relative_to(self.root.resolve()):
+            raise ValueError(f'Invalid key: {key}')
+        return path
+
+    def local_path(self, key: str) -> Path | None:
+        return self._path(key)
+
+    def _put(self, key: str, data: bytes) -> None:
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp = path.with_name(f'.{path.name}.{uuid4().hex}')
+        temp.write_bytes(data)
+        os.replace(temp, path)
+
+    async def put(self, key: str, data: bytes) -> None:
+        await run_in_threadpool(self._put, key, data)
+
+    def _get(self, key: str) -> bytes | None:
+        try:
+            return self._path(key).read_bytes()
+        except (FileNotFoundError, IsADirectoryError):
+            return None
+
+    async def get(self, key: str) -> bytes | None:
+        return await run_in_threadpool(self._get, key)
+
+    def _stat(self, key: str) -> ObjectStat | None:
+        path = self._path(key)
+        try:
+            stat_result = path.stat()
+        except FileNotFoundError:
+            return None
+        if not path.is_file():
+            return None
+
+        version = (str(path), stat_result.st_mtime_ns, stat_result.st_size)
+        etag = self.etag_cache.get(version)
+        if etag is None:
+            etag = '"%s"' % file_digest(path)
+            self.etag_cache.set(version, etag)
+        return ObjectStat(stat_result.st_size, stat_result.st_mtime, etag)
+
+    async def stat(self, key: str) -> ObjectStat | None:
+        return await run_in_threadpool(self._stat, key)
+
+    def _delete(self, key: str) -> None:
+        path = self._path(key)
+        path.unlink(missing_ok=True)
+        root = self.root.resolve()
+        for parent in path.parents:
+            if parent == root:
+                break
+            try:
+                parent.rmdir()
+            except OSError:
+                break
+
+    async def delete(self, key: str) -> None:
+        await run_in_threadpool(self._delete, key)
+
+    def _read_chunks(self, key: str, chunk_size: int):
+        with open(self._path(key), 'rb') as file:
+            while chunk := file.read(chunk_size):
+                yield chunk
+
+    async def stream(
+        self, key: str, chunk_size: int = CHUNK_SIZE
+    ) -> AsyncIterator[bytes]:
+        async for chunk in iterate_in_threadpool(
+            self._read_chunks(key, chunk_size)
+        ):
+            yield chunk
+
+    def _list(self, prefix: str) -> list[str]:
+        base = self._path(prefix.rstrip('/') or '.')
+        if prefix and not prefix.endswith('/'):
+            base = base.parent
+        if not base.is_dir():
+            return []
+
+        root = self.root.resolve()
+        keys = (
+            path.relative_to(root).as_posix()
+            for path in base.rglob('*') if path.is_file()
+        )
+        return sorted(key for key in keys if key.startswith(prefix))
+
+    async def list(self, prefix: str) -> list[str]:
+        return await run_in_threadpool(self._list, prefix)
+
+
+class S3Storage(Storage):
+    """Storage in a bucket of an S3-compatible service.
+
+    Requests are signed with AWS Signature Version 4 and use
+    path-style addressing, so it works with MinIO and other stand-ins.
+    """
+    service = 's3'
+
+    def __init__(
+        self,
+        endpoint_url: str,
+        bucket: str,
+        access_key: str,
+        secret_key: str,
+        region: str = 'us-east-1',
+        client: httpx.AsyncClient | None = None,
+    ) -> None:
+        self.endpoint_url = endpoint_url.rstrip('/')
+        self.bucket = bucket
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self._client = client
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient()
+        return self._client
+
+    def _sign(
+        self,
+        method: str,
+        path: str,
+        params: dict[str, str],
+        payload_hash: str,
+    ) -> dict[str, str]:
+        """Make the headers of a request signed with AWS Signature V4.
+        """
+        now = datetime.now(timezone.utc)
+        amz_date = now.strftime('%Y%m%dT%H%M%SZ')
+        date = now.strftime('%Y%m%d')
+        host = httpx.URL(self.endpoint_url).netloc.decode()
+        headers = {
+            'host': host,
+            'x-amz-content-sha256': payload_hash,
+            'x-amz-date': amz_date,
+        }
+        signed_headers = ';'.join(sorted(headers))
+        canonical_request = '\n'.join((
+            method,
+            path,
+            '&'.join(
+                f'{quote(key, safe="-_.~")}={quote(value, safe="-_.~")}'
+                for key, value in sorted(params.items())
+            ),
+            ''.join(f'{key}:{headers[key]}\n' for key in sorted(headers)),
+            signed_headers,
+            payload_hash,
+        ))
+        scope = f'{date}/{self.region}/{self.service}/aws4_request'
+        string_to_sign = '\n'.join((
+            'AWS4-HMAC-SHA256',
+            amz_date,
+            scope,
+            hashlib.sha256(canonical_request.encode()).hexdigest(),
+        ))
+        key = ('AWS4' + self.secret_key).encode()
+        for part in (date, self.region, self.service, 'aws4_request'):
+            key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+        signature = hmac.new(
+            key, string_to_sign.encode(), hashlib.sha256
+        ).hexdigest()
+
+        headers['authorization'] = (
+            f'AWS4-HMAC-SHA256 Credential={self.access_key}/{scope}, '
+            f'SignedHeaders={signed_headers}, Signature={signature}'
+        )
+        del headers['host']
+        return headers
+
+    def _build_request(
+        self,
+        method: str,
+        key: str = '',
+        params: dict[str, str] | None = None,
+        content: bytes = b'',
+    ) -> httpx.Request:
+        params = params or {}
+        path = quote(f'/{self.bucket}/{key}', safe='/-_.~')
+        headers = self._sign(
+            method, path, params, hashlib.sha256(content).hexdigest()
+        )
+        return self.client.build_request(
+            method,
+            self.endpoint_url + path,
+            params=params,
+            content=content,
+            headers=headers,
+        )
+
+    async def _send(self, request: httpx.Request) -> httpx.Response:
+        response = await self.client.send(request)
+        if response.status_code != 404:
+            response.raise_for_status()
+        return response
+
+    async def put(self, key: str, data: bytes) -> None:
+        await self._send(self._build_request('PUT', key, content=data))
+
+    async def get(self, key: str) -> bytes | None:
+        response = await self._send(self._build_request('GET', key))
+        if response.status_code == 404:
+            return None
+        return response.content
+
+    async def stat(self, key: str) -> ObjectStat | None:
+        response = await self._send(self._build_request('HEAD', key))
+        if response.status_code == 404:
+            return None
+
+        etag = response.headers['etag']
+        if not etag.startswith('"'):
+            etag = f'"{etag}"'
+        return ObjectStat(
+            size=int(response.headers['content-length']),
+            mtime=parsedate_to_datetime(
+                response.headers['last-modified']
+            ).timestamp(),
+            etag=etag,
+        )
+
+    async def delete(self, key: str) -> None:
+        await self._send(self._build_request('DELETE', key))
+
+    async def stream(
+        self, key: str, chunk_size: int = CHUNK_SIZE
+    ) -> AsyncIterator[bytes]:
+        response = await self.client.send(
+            self._build_request('GET', key), stream=True
+        )
+        try:
+            response.raise_for_status()
+            async for chunk in response.aiter_bytes(chunk_size):
+                yield chunk
+        finally:
+            await response.aclose()
+
+    async def list(self, prefix: str) -> list[str]:
+        keys = []
+        params = {'list-type': '2', 'prefix': prefix}
+        while True:
+            response = await self._send(
+                self._build_request('GET', params=params)
+            )
+            tree = ElementTree.fromstring(response.content)
+            namespace = tree.tag[:tree.tag.index('}') + 1] if (
+                tree.tag.startswith('{')
+            ) else ''
+            keys.extend(
+                element.text for element in tree.iter(namespace + 'Key')
+            )
+            token = tree.findtext(namespace + 'NextContinuationToken')
+            if not token:
+                return keys
+            params = params | {'continuation-token': token}
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
@@ -0,0 +1,182 @@
+from abc import ABC, abstractmethod
+from time import time
+from typing import Any
+
+from src.config import settings
+from src.core.cache import LRUCache
+
+# Counts the hit and reads both windows in one atomic step, so hits
+# of concurrent workers get distinct counts.
+REDIS_HIT_SCRIPT = """
+local current = redis.call('INCR', KEYS[2])
+if current == 1 then
+    redis.call('EXPIRE', KEYS[2], ARGV[1])
+end
+return {tonumber(redis.call('GET', KEYS[1]) or '0'), current}
+"""
+
+
+def sliding_window_wait(
+    previous: int, current: int, elapsed: float, limit: int, window: float
+) -> float:
+    """Get the time to wait before one more hit is allowed.
+
+    The number of hits in the last `window` seconds is estimated by
+    the counters of the current and the previous fixed windows:
+    the previous one is weighted by the part of it which is still
+    in the sliding window.
+
+    #### Args:
+      - previous (int):
+        Hits in the previous fixed window.
+      - current (int):
+        Hits in the current fixed window.
+      - elapsed (float):
+        Seconds since the start of the current fixed window.
+      - limit (int):
+        Allowed hits per window.
+      - window (float):
+        Length of the window in seconds.
+
+    #### Returns:
+      - float:
+        Seconds to wait, 0 if the hit is allowed.
+    """
+    allowed = limit - 1  # hits before this one
+    if previous * (window - elapsed) / window + current <= allowed:
+        return 0
+    if current <= allowed:
+        return window * (1 - (allowed - current) / previous) - elapsed
+    return window - elapsed + window * (1 - allowed / current)
+
+
+class ThrottleBackend(ABC):
+    """Storage of the hit counters of the sliding windows.
+    """
+    @abstractmethod
+    async def hit(self, key: str, limit: int, window: float) -> float:
+        """Count a hit if it is allowed.
+
+        #### Args:
+          - key (str):
+            Who hits, like `ip:127.0.0.1`.
+          - limit (int):
+            Allowed hits per window.
+          - window (float):
+            Length of the window in seconds.
+
+        #### Returns:
+          - float:
+            Seconds to wait, 0 if the hit is allowed and counted.
+        """
+
+    async def clear(self) -> None:
+        """Forget all hits.
+        """
+
+    async def close(self) -> None:
+        """Release the resources of the backend.
+        """
+
+
+class MemoryThrottleBackend(ThrottleBackend):
+    """Counters in the memory of the process, for a single node.
+    """
+    def __init__(self, maxsize: int = 100_000) -> None:
+        self.counters = LRUCache(maxsize)
+
+    async def hit(self, key: str, limit: int, window: float) -> float:
+        now = time()
+        index = int(now // window)
+        start, previous, current = self.counters.get(key, (index, 0, 0))
+        if start == index - 1:
+            previous, current = current, 0
+        elif start != index:
+            previous, current = 0, 0
+
+        wait = sliding_window_wait(
+            previous, current, now - index * window, limit, window
+        )
+        if not wait:
+            self.counters.set(key, (index, previous, current + 1), 2 * window)
+        return wait
+
+    async def clear(self) -> None:
+        self.counters.clear()
+
+
+class RedisThrottleBackend(ThrottleBackend):
+    """Counters in Redis, shared by all nodes.
+
+    Needs the `redis` package.
+    """
+    def __init__(
+        self, url: str = '', prefix: str = 'throttle:', client: Any = None
+    ) -> None:
+        """
+        #### Args:
+          - url (str): Default ''.
+            URL of Redis, used if `client` is None.
+          - prefix (str): Default 'throttle:'.
+            Prefix of the keys of the counters.
+          - client (Any): Default None.
+            A client of `redis.asyncio`.
+
+        #### Raises:
+          - RuntimeError:
+            The `redis` package is not installed.
+        """
+        if client is None:
+            try:
+                from redis.asyncio import Redis
+            except ImportError:
+                raise RuntimeError(
+                    'THROTTLE_BACKEND=redis needs the `redis` package'
+                ) from None
+            client = Redis.from_url(url)
+
+        self.client: Any = client
+        self.prefix = prefix
+        self._hit_script = self.client.register_script(REDIS_HIT_SCRIPT)
+
+    async def hit(self, key: str, limit: int, window: float) -> float:
+        now = time()
+        index = int(now // window)
+        current_key = f'{self.prefix}{key}:{index}'
+        previous, current = await self._hit_script(
+            keys=[f'{self.prefix}{key}:{index - 1}', current_key],
+            args=[int(2 * window) + 1],
+        )
+        wait = sliding_window_wait(
+            int(previous),
+            int(current) - 1,  # hits before this one
+            now - index * window,
+            limit,
+            window,
+        )
+        if wait:
+            # Rejected hits are not counted, like in memory.
+            await self.client.decr(current_key)
+        return wait
+
+    async def clear(self) -> None:
+        async for key in self.client.scan_iter(match=f'{self.prefix}*'):
+            await self.client.delete(key)
+
+    async def close(self) -> None:
+        await self.client.close()
+
+
+def create_throttle_backend() -> ThrottleBackend:
+    """Create the backend of throttling selected in the settings.
+
+    #### Returns:
+      - ThrottleBackend:
+        Counters in memory or in Redis.
+    """
+    if settings.throttle_backend == 'redis':
+        return RedisThrottleBackend(settings.redis_url)
+    return MemoryThrottleBackend()
+
+
+throttle_backend = create_throttle_backend()
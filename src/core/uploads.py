@@ -0,0 +1,120 @@
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+from typing import IO, AsyncGenerator, AsyncIterator
+
+from fastapi import Request
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import UploadFile
+from starlette.formparsers import MultiPartException, MultiPartParser
+
+from src.core.exceptions import (
+    AvatarException,
+    PayloadTooLargeException,
+    UnsupportedMediaTypeException,
+)
+
+CHUNK_SIZE = 64 * 1024
+
+
+async def limit_stream(
+    stream: AsyncIterator[bytes], max_bytes: int
+) -> AsyncGenerator[bytes, None]:
+    """Pass the chunks of the stream until it exceeds the limit.
+
+    #### Args:
+      - stream (AsyncIterator[bytes]):
+        The body of the request.
+      - max_bytes (int):
+        Maximum size of the body.
+
+    #### Raises:
+      - PayloadTooLargeException:
+        The body is larger than `max_bytes`.
+    """
+    received = 0
+    async for chunk in stream:
+        received += len(chunk)
+        if received > max_bytes:
+            raise PayloadTooLargeException
+        yield chunk
+
+
+async def _write_chunks(
+    chunks: AsyncIterator[bytes], file: IO[bytes]
+) -> None:
+    async for chunk in chunks:
+        await run_in_threadpool(file.write, chunk)
+
+
+async def _read_upload(upload: UploadFile) -> AsyncGenerator[bytes, None]:
+    while chunk := await upload.read(CHUNK_SIZE):
+        yield chunk
+
+
+async def _write_form_file(
+    request: Request, body: AsyncIterator[bytes], file: IO[bytes]
+) -> None:
+    parser = MultiPartParser(request.headers, body, max_files=1, max_fields=4)
+    try:
+        form = await parser.parse()
+    except MultiPartException as err:
+        raise AvatarException(detail=err.message)
+
+    try:
+        uploads = [
+            value for _, value in form.multi_items()
+            if isinstance(value, UploadFile)
+        ]
+        if not uploads:
+            raise AvatarException(detail='The form does not contain a file')
+
+        await _write_chunks(_read_upload(uploads[0]), file)
+    finally:
+        await form.close()
+
+
+async def save_upload(request: Request, max_bytes: int) -> Path:
+    """Stream an uploaded file into a temporary file.
+
+    The body is either `multipart/form-data` with one file
+    or the raw file with the `image/*` content type. Only one chunk
+    of the body is kept in memory at a time.
+
+    #### Args:
+      - request (Request):
+        The request with the file.
+      - max_bytes (int):
+        Maximum size of the body.
+
+    #### Raises:
+      - PayloadTooLargeException:
+        The body is larger than `max_bytes`.
+      - UnsupportedMediaTypeException:
+        Unknown content type.
+      - AvatarException:
+        The form does not contain a file.
+
+    #### Returns:
+      - Path:
+        The temporary file. The caller must delete it.
+    """
+    content_length = request.headers.get('content-length', '')
+    if content_length.isdigit() and int(content_length) > max_bytes:
+        raise PayloadTooLargeException
+
+    content_type = request.headers.get('content-type', '')
+    body = limit_stream(request.stream(), max_bytes)
+    with NamedTemporaryFile(delete=False) as file:
+        try:
+            if content_type.startswith('image/'):
+                await _write_chunks(body, file)
+            elif content_type.startswith('multipart/form-data'):
+                await _write_form_file(request, body, file)
+            else:
+                raise UnsupportedMediaTypeException
+        except BaseException:
+            file.close()
+            Path(file.name).unlink()
+            raise
+
+    return Path(file.name)
@@ -1,5 +1,5 @@
 """Import `Base` and others for `alembic`.
 """
-from src.users.models import UserTable
+from src.users.models import RevokedTokenTable, UserTable
 
 from .database import Base
@@ -1,4 +1,6 @@
-from sqlalchemy import update
+from typing import Any, AsyncIterator
+
+from sqlalchemy import Row, insert, select, update
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 
@@ -33,12 +35,155 @@ class CRUD:
         try:
             await db.commit()
         except IntegrityError as err:
+            await db.rollback()
             return None, err.args[0].split('.')[-1]
 
         if refresh:
             await db.refresh(db_obj)
         return db_obj, None
 
+    def _returning(self, db: AsyncSession, statement: str) -> bool:
+        """Check that the dialect supports `INSERT/UPDATE ... RETURNING`.
+        """
+        return getattr(db.get_bind().dialect, f'{statement}_returning')
+
+    async def create_returning(
+        self, db: AsyncSession, new_obj: dict, columns: list[Any] | None = None
+    ) -> tuple[Row, None] | tuple[None, str]:
+        """Create a new object and get its columns with one statement.
+
+        Uses `INSERT ... RETURNING` if the dialect supports it,
+        else saves the object and reads it back like `create`.
+
+        #### Args:
+          - db (AsyncSession):
+            Connecting to the database.
+          - new_obj (dict):
+            Data to save to the database.
+          - columns (list[Any] | None): Default None.
+            Columns to return, all columns of the table if None.
+
+        #### Returns:
+          - tuple[Row, None] | tuple[None, str]:
+            (None, error description) if the save is not successful.
+        """
+        columns = columns or list(self.model.__table__.columns)
+        if not self._returning(db, 'insert'):
+            db_obj, err = await self.create(db, new_obj)
+            if err is not None:
+                return None, err
+            return await self._read_columns(db, db_obj.id, columns), None
+
+        try:
+            result = await db.execute(
+                insert(
+                    self.model.__table__
+                ).values(
+                    new_obj
+                ).returning(
+                    *columns
+                )
+            )
+            row = result.one()
+            await db.commit()
+        except IntegrityError as err:
+            await db.rollback()
+            return None, err.args[0].split('.')[-1]
+        return row, None
+
+    async def find_conflicts(
+        self, db: AsyncSession, new_objs: list[dict]
+    ) -> list[str | None]:
+        """Find objects which conflict by unique columns.
+
+        An object conflicts if its value of a unique column exists
+        in the database or in one of the previous objects.
+
+        #### Args:
+          - db (AsyncSession):
+            Connecting to the database.
+          - new_objs (list[dict]):
+            Data to check.
+
+        #### Returns:
+          - list[str | None]:
+            For every object None if there is no conflict
+            else the name of the conflicting column.
+        """
+        errors: list[str | None] = [None] * len(new_objs)
+        for column in self.model.__table__.columns:
+            if not column.unique:
+                continue
+
+            values = {
+                obj[column.name] for obj in new_objs if column.name in obj
+            }
+            existing = set(await db.scalars(
+                select(column).where(column.in_(values))
+            ))
+            for i, obj in enumerate(new_objs):
+                value = obj.get(column.name)
+                if errors[i] is None and value is not None:
+                    if value in existing:
+                        errors[i] = column.name
+                    existing.add(value)
+        return errors
+
+    async def bulk_create(
+        self,
+        db: AsyncSession,
+        new_objs: list[dict],
+        errors: list[str | None] | None = None,
+    ) -> list[str | None]:
+        """Create many objects in the database with one statement.
+
+        Objects which conflict with existing rows or with each other
+        by unique columns are skipped instead of failing the batch.
+
+        #### Args:
+          - db (AsyncSession):
+            Connecting to the database.
+          - new_objs (list[dict]):
+            Data to save to the database.
+          - errors (list[str | None] | None): Default None.
+            The result of `find_conflicts` if it is already known.
+
+        #### Returns:
+          - list[str | None]:
+            For every object None if it is created
+            else the name of the conflicting column.
+        """
+        if errors is None:
+            errors = await self.find_conflicts(db, new_objs)
+        rows = [obj for obj, err in zip(new_objs, errors) if err is None]
+        if not rows:
+            return errors
+
+        try:
+            await db.execute(insert(self.model), rows)
+            await db.commit()
+        except IntegrityError:
+            await db.rollback()
+            return await self._create_one_by_one(db, new_objs, errors)
+
+        return errors
+
+    async def _create_one_by_one(
+        self, db: AsyncSession, new_objs: list[dict], errors: list[str | None]
+    ) -> list[str | None]:
+        """Fallback of `bulk_create` if rows were added concurrently.
+        """
+        for i, obj in enumerate(new_objs):
+            if errors[i] is not None:
+                continue
+            try:
+                async with db.begin_nested():
+                    await db.execute(insert(self.model), [obj])
+            except IntegrityError as err:
+                errors[i] = err.args[0].split('.')[-1]
+        await db.commit()
+        return errors
+
     async def update(
         self, db: AsyncSession, obj_id: int, update_data: dict
     ) -> None | str:
@@ -70,8 +215,72 @@ class CRUD:
             await db.execute(query)
             await db.commit()
         except IntegrityError as err:
+            await db.rollback()
             return err.args[0].split('.')[-1]
 
+    async def update_returning(
+        self,
+        db: AsyncSession,
+        obj_id: int,
+        update_data: dict,
+        columns: list[Any] | None = None,
+    ) -> tuple[Row | None, None] | tuple[None, str]:
+        """Update an object and get its new columns with one statement.
+
+        Uses `UPDATE ... RETURNING` if the dialect supports it,
+        else reads the object after the update.
+
+        #### Args:
+          - db (AsyncSession):
+            Connecting to the database.
+          - obj_id (int):
+            ID of the object being updated.
+          - update_data (dict):
+            Updated data.
+          - columns (list[Any] | None): Default None.
+            Columns to return, all columns of the table if None.
+
+        #### Returns:
+          - tuple[Row | None, None] | tuple[None, str]:
+            The updated row, None if there is no such object,
+            or (None, error description) if the update is not successful.
+        """
+        if not update_data:
+            return None, 'No update data'
+
+        columns = columns or list(self.model.__table__.columns)
+        if not self._returning(db, 'update'):
+            err = await self.update(db, obj_id, update_data)
+            if err is not None:
+                return None, err
+            return await self._read_columns(db, obj_id, columns), None
+
+        query = update(
+            self.model.__table__
+        ).where(
+            self.model.id == obj_id
+        ).values(
+            update_data
+        ).returning(
+            *columns
+        )
+        try:
+            row = (await db.execute(query)).first()
+            await db.commit()
+        except IntegrityError as err:
+            await db.rollback()
+            return None, err.args[0].split('.')[-1]
+        return row, None
+
+    async def _read_columns(
+        self, db: AsyncSession, obj_id: int, columns: list[Any]
+    ) -> Row | None:
+        """Fallback of the `RETURNING` methods.
+        """
+        return (await db.execute(
+            select(*columns).where(self.model.id == obj_id)
+        )).first()
+
     async def get(self, db: AsyncSession, id: int) -> Base | None:
         """Get an object from the database by ID.
 
@@ -86,3 +295,48 @@ class CRUD:
             An object if it exists in the database else None.
         """
         return await db.get(self.model, id)
+
+    async def iter_chunks(
+        self,
+        db: AsyncSession,
+        columns: list[Any],
+        chunk_size: int,
+        *filters: Any,
+    ) -> AsyncIterator[list[Row]]:
+        """Read all rows in chunks ordered by ID.
+
+        Every chunk is a keyset query (`id > last_id`) read through
+        a server-side cursor, so memory use does not depend on the size
+        of the table.
+
+        #### Args:
+          - db (AsyncSession):
+            Connecting to the database.
+          - columns (list[Any]):
+            Columns to read, must include `id`.
+          - chunk_size (int):
+            Number of rows in a chunk.
+          - filters (Any):
+            Conditions of the query.
+
+        #### Yields:
+          - list[Row]:
+            The next chunk of rows.
+        """
+        last_id = 0
+        while True:
+            result = await db.stream(
+                select(*columns).where(
+                    self.model.id > last_id, *filters
+                ).order_by(
+                    self.model.id
+                ).limit(
+                    chunk_size
+                )
+            )
+            chunk = [row async for row in result]
+            if not chunk:
+                return
+
+            yield chunk
+            last_id = chunk[-1].id
@@ -1,34 +1,435 @@
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
-from sqlalchemy.orm import declarative_base, sessionmaker
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from itertools import cycle, islice
+from time import monotonic, perf_counter
+from typing import Any, Iterator
+
+from fastapi import Request
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
+    AsyncSession,
+    create_async_engine,
+)
+from sqlalchemy.orm import Session, declarative_base, sessionmaker
 from sqlalchemy.orm.decl_api import DeclarativeMeta
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
 from src.config import settings
+from src.core.metrics import DB_QUERIES, DB_QUERY_DURATION
+
+SQL_STATEMENTS = {'SELECT', 'INSERT', 'UPDATE', 'DELETE'}
 
 Base: DeclarativeMeta = declarative_base()
 
-if 'sqlite' in settings.database_url:
-    engine = create_async_engine(
-        url=settings.database_url,
-        connect_args={"check_same_thread": False},
-        echo=settings.debug,
-    )
-else:
-    engine = create_async_engine(
-        url=settings.database_url,
-        echo=settings.debug,
+logger = logging.getLogger(__name__)
+
+
+@dataclass(slots=True)
+class QueryStats:
+    """SQL statements executed during a request.
+    """
+    count: int = 0
+    seconds: float = 0
+
+
+# Stats of the current request, set by `QueryTimingMiddleware`.
+query_stats: ContextVar[QueryStats | None] = ContextVar(
+    'query_stats', default=None
+)
+
+
+@contextmanager
+def track_queries() -> Iterator[QueryStats]:
+    """Count the statements executed inside the block.
+
+    Engine events run in the context of the caller, so the statements
+    of the same task or thread are counted, like in a request.
+    """
+    stats = QueryStats()
+    token = query_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        query_stats.reset(token)
+
+
+def redact_parameters(parameters: Any) -> str:
+    """Describe the parameters of a statement without their values.
+    """
+    if isinstance(parameters, dict):
+        return '{%s}' % ', '.join(
+            f'{name}: {type(value).__name__}'
+            for name, value in parameters.items()
+        )
+    if isinstance(parameters, (list, tuple)):
+        if parameters and isinstance(parameters[0], (dict, list, tuple)):
+            return f'<{len(parameters)} rows>'
+        return '(%s)' % ', '.join(
+            type(value).__name__ for value in parameters
+        )
+    return f'<{type(parameters).__name__}>'
+
+
+def record_query(statement: str, parameters: Any, elapsed: float) -> None:
+    """Report an executed statement to the metrics and the request stats.
+
+    Statements slower than `settings.slow_query_ms` are logged with
+    the types of the parameters instead of the values.
+    """
+    kind = statement.lstrip()[:6].upper()
+    if kind not in SQL_STATEMENTS:
+        kind = 'OTHER'
+    DB_QUERIES.inc(kind)
+    DB_QUERY_DURATION.observe(elapsed, kind)
+
+    stats = query_stats.get()
+    if stats is not None:
+        stats.count += 1
+        stats.seconds += elapsed
+
+    if 0 < settings.slow_query_ms <= elapsed * 1000:
+        logger.warning(
+            'Slow query %.1f ms: %s; parameters: %s',
+            elapsed * 1000,
+            ' '.join(statement.split()),
+            redact_parameters(parameters),
+        )
+
+
+def instrument_engine(engine: AsyncEngine) -> None:
+    """Count and time the SQL statements of the engine.
+
+    The start time is kept on the execution context of the statement,
+    so failed statements, which get `handle_error` instead of
+    `after_cursor_execute`, are counted and leave nothing behind.
+
+    #### Args:
+      - engine (AsyncEngine):
+        The engine.
+    """
+    @event.listens_for(engine.sync_engine, 'before_cursor_execute')
+    def before_execute(
+        conn, cursor, statement, parameters, context, executemany
+    ) -> None:
+        if context is not None:
+            context.query_start = perf_counter()
+
+    @event.listens_for(engine.sync_engine, 'after_cursor_execute')
+    def after_execute(
+        conn, cursor, statement, parameters, context, executemany
+    ) -> None:
+        start = getattr(context, 'query_start', None)
+        if start is not None:
+            record_query(statement, parameters, perf_counter() - start)
+
+    @event.listens_for(engine.sync_engine, 'handle_error')
+    def on_error(exception_context) -> None:
+        context = exception_context.execution_context
+        start = getattr(context, 'query_start', None)
+        if start is not None and exception_context.statement is not None:
+            record_query(
+                exception_context.statement,
+                exception_context.parameters,
+                perf_counter() - start,
+            )
+
+
+class QueryTimingMiddleware:
+    """Count the SQL statements of every request.
+
+    The count and the total time are sent in the `Server-Timing`
+    header, like `db;dur=1.5;desc="3 queries"`. Statements executed
+    after the response has started, like background tasks, are not
+    included.
+    """
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(
+        self, scope: Scope, receive: Receive, send: Send
+    ) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        async def send_timing(message: Message) -> None:
+            if message['type'] == 'http.response.start':
+                timing = 'db;dur=%.1f;desc="%d queries"' % (
+                    stats.seconds * 1000, stats.count
+                )
+                message['headers'] = [
+                    *message.get('headers', []),
+                    (b'server-timing', timing.encode()),
+                ]
+            await send(message)
+
+        with track_queries() as stats:
+            await self.app(scope, receive, send_timing)
+
+
+def sqlite_pragmas() -> dict[str, str | int]:
+    """Get the pragmas applied to every new SQLite connection.
+    """
+    return {
+        'journal_mode': settings.sqlite_journal_mode,
+        'synchronous': settings.sqlite_synchronous,
+        'cache_size': settings.sqlite_cache_size,
+        'mmap_size': settings.sqlite_mmap_size,
+        'busy_timeout': settings.sqlite_busy_timeout,
+    }
+
+
+def set_sqlite_pragmas(engine: AsyncEngine, pragmas: dict) -> None:
+    """Apply the pragmas on every connect event of the engine.
+
+    #### Args:
+      - engine (AsyncEngine):
+        The engine of a SQLite database.
+      - pragmas (dict):
+        Names and values of the pragmas.
+    """
+    @event.listens_for(engine.sync_engine, 'connect')
+    def on_connect(dbapi_connection, connection_record) -> None:
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
+
+
+def create_engine(
+    url: str, pragmas: dict | None = None, **kwargs
+) -> AsyncEngine:
+    """Create the engine with the pool settings of the application.
+
+    A file SQLite database gets a queue pool instead of opening
+    a connection for every session, and the pragmas are applied
+    to every new connection.
+
+    #### Args:
+      - url (str):
+        URL of the database.
+      - pragmas (dict | None): Default None.
+        SQLite pragmas, `sqlite_pragmas()` if None.
+      - kwargs:
+        Other arguments of `create_async_engine`.
+
+    #### Returns:
+      - AsyncEngine:
+        The engine.
+    """
+    pool_kwargs = {
+        'pool_size': settings.db_pool_size,
+        'max_overflow': settings.db_max_overflow,
+        'pool_recycle': settings.db_pool_recycle,
+        'pool_pre_ping': settings.db_pool_pre_ping,
+    }
+    sa_url = make_url(url)
+    if sa_url.get_backend_name() != 'sqlite':
+        return create_async_engine(url, **pool_kwargs | kwargs)
+
+    kwargs.setdefault('connect_args', {'check_same_thread': False})
+    if sa_url.database and sa_url.database != ':memory:':
+        kwargs = {'poolclass': AsyncAdaptedQueuePool} | pool_kwargs | kwargs
+    engine = create_async_engine(url, **kwargs)
+    set_sqlite_pragmas(
+        engine, sqlite_pragmas() if pragmas is None else pragmas
     )
+    return engine
+
+
+class PrimarySession(Session):
+    """Session of the primary database.
+
+    A commit marks the state of the request, so the following reads
+    of the request see the written data.
+    """
+
+
+@event.listens_for(PrimarySession, 'after_commit')
+def mark_written(session: Session) -> None:
+    state = session.info.get('state')
+    if state is not None:
+        state.db_written = True
+
+
+class ReplicaSession(Session):
+    """Session of a replica.
+
+    The bind is checked on every statement, so after a write of the
+    request the statements go to the primary, even in a session opened
+    before the write.
+    """
+    def get_bind(self, mapper=None, **kwargs):
+        if getattr(self.info.get('state'), 'db_written', False):
+            return self.info['primary']
+        return super().get_bind(mapper, **kwargs)
+
+
+class DatabaseRouter:
+    """Route sessions of reads to replicas and of writes to the primary.
+
+    Replicas are chosen round-robin. A replica which fails to connect
+    is skipped for `retry_after` seconds, if all of them fail, reads go
+    to the primary. A successful check of a replica is trusted for
+    `check_interval` seconds, so requests do not connect just to check.
+    """
+    def __init__(
+        self,
+        primary: AsyncEngine,
+        replicas: list[AsyncEngine] | None = None,
+        retry_after: float = 5,
+        check_interval: float = 1,
+    ) -> None:
+        self.primary = primary
+        self.replicas = replicas or []
+        self.retry_after = retry_after
+        self.check_interval = check_interval
+        self._turns = cycle(range(len(self.replicas)))
+        self._down_until: dict[int, float] = {}
+        self._checked_until: dict[int, float] = {}
+        self._sessions = sessionmaker(
+            class_=AsyncSession,
+            sync_session_class=PrimarySession,
+            expire_on_commit=False,
+            autoflush=False,
+            autocommit=False,
+        )
+        self._replica_sessions = sessionmaker(
+            class_=AsyncSession,
+            sync_session_class=ReplicaSession,
+            expire_on_commit=False,
+            autoflush=False,
+            autocommit=False,
+        )
+
+    def candidates(self) -> list[AsyncEngine]:
+        """Get the healthy replicas in the order to try them.
+        """
+        if not self.replicas:
+            return []
+
+        now = monotonic()
+        start = next(self._turns)
+        order = islice(
+            cycle(range(len(self.replicas))), start, start + len(self.replicas)
+        )
+        return [
+            self.replicas[i] for i in order
+            if self._down_until.get(i, 0) <= now
+        ]
+
+    def mark_down(self, engine: AsyncEngine) -> None:
+        """Skip the replica until `retry_after` seconds pass.
+        """
+        index = self.replicas.index(engine)
+        self._down_until[index] = monotonic() + self.retry_after
+        self._checked_until.pop(index, None)
+
+    async def check(self, engine: AsyncEngine) -> bool:
+        """Check that the replica accepts connections.
+
+        The replica is connected only if it was not checked in the last
+        `check_interval` seconds.
 
-SessionLocal = sessionmaker(
-    bind=engine,
-    class_=AsyncSession,
-    expire_on_commit=False,
-    autoflush=False,
-    autocommit=False,
+        #### Args:
+          - engine (AsyncEngine):
+            The replica.
+
+        #### Returns:
+          - bool:
+            Is the replica healthy, if not, it is marked down.
+        """
+        index = self.replicas.index(engine)
+        if self._checked_until.get(index, 0) > monotonic():
+            return True
+
+        try:
+            async with engine.connect():
+                pass
+        except (DBAPIError, OSError):
+            self.mark_down(engine)
+            return False
+        self._checked_until[index] = monotonic() + self.check_interval
+        return True
+
+    def write_session(self, state: Any = None) -> AsyncSession:
+        """Get a session of the primary database.
+
+        #### Args:
+          - state (Any): Default None.
+            The state of the request, marked after a commit.
+
+        #### Returns:
+          - AsyncSession:
+            The session.
+        """
+        info = {} if state is None else {'state': state}
+        return self._sessions(bind=self.primary, info=info)
+
+    async def read_session(self, state: Any = None) -> AsyncSession:
+        """Get a session of a healthy replica.
+
+        #### Args:
+          - state (Any): Default None.
+            The state of the request. If the request has written data,
+            the primary is used, also by the statements of the session
+            executed after a later write.
+
+        #### Returns:
+          - AsyncSession:
+            The session, of the primary if there are no healthy replicas.
+        """
+        if not getattr(state, 'db_written', False):
+            for replica in self.candidates():
+                if await self.check(replica):
+                    return self._replica_sessions(
+                        bind=replica,
+                        info={
+                            'state': state,
+                            'primary': self.primary.sync_engine,
+                        },
+                    )
+
+        return self._sessions(bind=self.primary)
+
+
+engine = create_engine(settings.database_url, echo=settings.debug)
+
+db_router = DatabaseRouter(
+    engine,
+    [
+        create_engine(url, echo=settings.debug)
+        for url in settings.database_replica_urls
+    ],
+    settings.replica_retry_after,
+    settings.replica_check_interval,
 )
+for db_engine in (engine, *db_router.replicas):
+    instrument_engine(db_engine)
+
+
+async def get_db(request: Request) -> AsyncSession:
+    """Get a session of the primary database for writes.
+    """
+    db = db_router.write_session(request.state)
+    try:
+        yield db
+    finally:
+        await db.close()
+
 
+async def get_read_db(request: Request) -> AsyncSession:
+    """Get a session of a replica for reads.
 
-async def get_db() -> AsyncSession:
-    db = SessionLocal()
+    After a write in the same request, the primary is used.
+    """
+    db = await db_router.read_session(request.state)
     try:
         yield db
     finally:
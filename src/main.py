@@ -1,6 +1,17 @@
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 
 from src.config import AVATARS_DIR, MEDIA_DIR, settings
+from src.core.metrics import MetricsMiddleware, register_caches, registry
+from src.core.profiling import ProfilingMiddleware
+from src.core.services import avatar_cache, avatar_pool, avatar_storage
+from src.core.storage import LocalStorage
+from src.core.throttling import throttle_backend
+from src.db.database import QueryTimingMiddleware
+from src.users.authentication import token_cache
+from src.users.cache import token_versions, user_cache
+from src.users.hashing import hasher
+from src.users.revocation import revocations
 from src.users.router import router as users_router
 
 app = FastAPI(
@@ -10,9 +21,36 @@ app = FastAPI(
 )
 
 app.include_router(users_router, tags=['Users'])
+app.add_middleware(ProfilingMiddleware)
+app.add_middleware(QueryTimingMiddleware)
+
+if settings.metrics_enabled:
+    app.add_middleware(MetricsMiddleware)
+    register_caches({
+        'user': user_cache,
+        'token': token_cache,
+        'token_version': token_versions,
+        'revocation': revocations.revoked,
+        'avatar': avatar_cache,
+        'etag': LocalStorage.etag_cache,
+    })
+
+    @app.get('/metrics', include_in_schema=False)
+    async def read_metrics() -> PlainTextResponse:
+        return PlainTextResponse(
+            registry.render(), media_type='text/plain; version=0.0.4'
+        )
 
 
 @app.on_event('startup')
 async def create_dirs():
     MEDIA_DIR.mkdir(exist_ok=True)
     AVATARS_DIR.mkdir(exist_ok=True)
+
+
+@app.on_event('shutdown')
+async def shutdown_pools():
+    hasher.shutdown()
+    avatar_pool.shutdown()
+    await avatar_storage.close()
+    await throttle_backend.close()
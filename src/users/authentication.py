@@ -1,56 +1,83 @@
 from datetime import datetime, timedelta
+from hashlib import blake2b
+from math import ceil
+from time import time
+from typing import Any
+from uuid import uuid4
 
-from fastapi import Depends
+from fastapi import BackgroundTasks, Depends, Request
 from fastapi.security.oauth2 import OAuth2PasswordBearer
 from jose import JWTError, jwt
-from passlib.context import CryptContext
+from sqlalchemy import Row
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.config import settings
-from src.core.exceptions import CredentialsException, NotActiveUserException
-from src.db.database import get_db
-from src.users.models import UserTable, orm
-from src.users.schemes import PhoneScheme
+from src.core.cache import LRUCache
+from src.core.exceptions import (
+    CredentialsException,
+    NotActiveUserException,
+    NotStaffUserException,
+    TooManyRequestsException,
+)
+from src.core.throttling import throttle_backend
+from src.db.database import get_read_db
+from src.users.cache import UserSnapshot, user_cache
+from src.users.forms import PhoneAuthForm
+from src.users.hashing import hasher
+from src.users.keys import is_asymmetric, key_ring
+from src.users.models import orm
+from src.users.revocation import revocations
+from src.users.schemes import TokenDataScheme
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl='token')
-pwd_context = CryptContext(schemes=['bcrypt'], deprecated='auto')
+token_cache = LRUCache(settings.token_cache_size)
 
 
-def verify_password(password: str, hash_password: str) -> bool:
-    """Check the password and hash password match.
+async def check_login_rate(
+    request: Request, form: PhoneAuthForm = Depends()
+) -> None:
+    """Reject the attempt to log in before any hashing or database work
+    if there were too many attempts from the IP or to the phone number.
 
     #### Args:
-      - password (str):
-        The password for verification.
-      - hash_password (str):
-        The password hash from the database.
-
-    #### Returns:
-      - bool:
-        Does the password and hash password match.
-    """
-    return pwd_context.verify(secret=password, hash=hash_password)
-
-
-def get_hash_password(password: str) -> str:
-    """Get a hash from a password.
+      - request (Request):
+        The request, for the client IP.
+      - form (PhoneAuthForm):
+        The login form, for the phone number.
 
-    #### Args:
-      - password (str):
-        Password for hashing.
-
-    #### Returns:
-      - str:
-        The hash of the password.
+    #### Raises:
+      - TooManyRequestsException:
+        The limit is exceeded.
     """
-    return pwd_context.hash(secret=password)
+    window = settings.login_rate_window
+    # Some servers do not report the client, they share one counter.
+    host = request.client.host if request.client else 'unknown'
+    limits = (
+        (f'ip:{host}', settings.login_rate_per_ip),
+        (f'phone:{form.username}', settings.login_rate_per_phone),
+    )
+    for key, limit in limits:
+        if limit <= 0:
+            continue
+        wait = await throttle_backend.hit(f'login:{key}', limit, window)
+        if wait:
+            raise TooManyRequestsException(
+                headers={'Retry-After': str(ceil(wait))}
+            )
 
 
 async def authenticate_user(
-    db: AsyncSession, phone: int, password: str
-) -> UserTable | None:
+    db: AsyncSession,
+    phone: int,
+    password: str,
+    background_tasks: BackgroundTasks | None = None,
+    write_db: AsyncSession | None = None,
+) -> Row | None:
     """Get the user from the database if the password matches.
 
+    If the stored hash is outdated and `background_tasks` is given,
+    the password is hashed again after the response.
+
     #### Args:
       - db (AsyncSession):
         Connecting to the database.
@@ -58,21 +85,81 @@ async def authenticate_user(
         Unique phone number as an identifier.
       - password (str):
         Password.
+      - background_tasks (BackgroundTasks | None): Default None.
+        Tasks of the request for rehashing.
+      - write_db (AsyncSession | None): Default None.
+        Connecting to the primary database, `db` if None.
 
     #### Returns:
-      - UserTable | None:
-        The user object from the database if the password matches else None.
+      - Row | None:
+        The credentials of the user if the password matches else None.
     """
-    user = await orm.get_user_by_phone(db, phone)
-    if user is not None and pwd_context.verify(password, user.password):
-        return user
+    user = await orm.get_credentials(db, phone)
+    if user is None or not await hasher.verify(password, user.password):
+        return None
+
+    if background_tasks is not None and hasher.needs_update(user.password):
+        background_tasks.add_task(
+            rehash_password, write_db or db, user.id, password, user.password
+        )
+    return user
+
+
+async def rehash_password(
+    db: AsyncSession, user_id: int, password: str, old_hash: str
+) -> None:
+    """Save a hash of the password with the current settings.
+
+    Nothing is saved if the password was changed after the login,
+    so the old password is not restored.
+
+    #### Args:
+      - db (AsyncSession):
+        Connecting to the primary database.
+      - user_id (int):
+        User ID.
+      - password (str):
+        The verified password.
+      - old_hash (str):
+        The verified hash.
+    """
+    await orm.replace_password(
+        db, user_id, old_hash, await hasher.hash(password)
+    )
 
 
-def create_access_token(data: dict[str, str]) -> str:
+def token_claims(user: Row) -> dict[str, Any]:
+    """Get the claims of the access token of the user.
+
+    With `self_contained_tokens` the token carries the ID, the flags
+    and the token version of the user, so authenticated requests check
+    the version instead of reading the user. The username, which users
+    change freely, is not included: renaming does not revoke tokens.
+
+    #### Args:
+      - user (Row):
+        The credentials of the user.
+
+    #### Returns:
+      - dict[str, Any]:
+        The claims.
+    """
+    claims = {'sub': str(user.phone)}
+    if settings.self_contained_tokens:
+        claims |= {
+            'uid': user.id,
+            'act': user.is_active,
+            'stf': user.is_staff,
+            'ver': user.token_version,
+        }
+    return claims
+
+
+def create_access_token(data: dict[str, Any]) -> str:
     """Create JWT token.
 
     #### Args:
-      - data (dict[str, str]):
+      - data (dict[str, Any]):
         Data for creating a token.
 
     #### Returns:
@@ -83,23 +170,47 @@ def create_access_token(data: dict[str, str]) -> str:
     expire = datetime.utcnow() + timedelta(
         minutes=settings.access_token_expire_minutes
     )
-    to_encode.update({'exp': expire})
-    jwt_token = jwt.encode(
+    to_encode.update({'exp': expire, 'jti': uuid4().hex})
+    if not is_asymmetric(settings.algorithm):
+        return jwt.encode(
+            claims=to_encode,
+            key=settings.secret_key,
+            algorithm=settings.algorithm,
+        )
+
+    signing_key = key_ring.current
+    return jwt.encode(
         claims=to_encode,
-        key=settings.secret_key,
+        key=signing_key.private_key,
         algorithm=settings.algorithm,
+        headers={'kid': signing_key.kid},
     )
-    return jwt_token
 
 
-async def get_current_user(
-    db: AsyncSession = Depends(get_db), token: str = Depends(oauth2_scheme)
-) -> UserTable:
-    """Get a user by token.
+def get_verification_key(token: str) -> Any:
+    """Get the key to verify the token.
+
+    #### Raises:
+      - JWTError:
+        The token is malformed or its `kid` is unknown.
+    """
+    if not is_asymmetric(settings.algorithm):
+        return settings.secret_key
+
+    signing_key = key_ring.get(jwt.get_unverified_header(token).get('kid'))
+    if signing_key is None:
+        raise JWTError('Unknown key')
+    return signing_key.public_key
+
+
+def decode_token(token: str) -> TokenDataScheme:
+    """Verify JWT token and get its data.
+
+    Verified data is cached until the token expires, so the signature
+    is checked once per token, not once per request. A cached token
+    is rejected once its signing key is removed from `key_ring`.
 
     #### Args:
-      - db (AsyncSession):
-        Connecting to the database.
       - token (str):
         JWT token.
 
@@ -108,47 +219,134 @@ async def get_current_user(
         The token is invalid.
 
     #### Returns:
-      - UserTable:
-        The user object from the database.
+      - TokenDataScheme:
+        The data of the token.
     """
+    key = blake2b(token.encode(), digest_size=16).digest()
+    token_data = token_cache.get(key)
+    if token_data is not None:
+        if token_data.kid is not None and key_ring.get(token_data.kid) is None:
+            raise CredentialsException
+        return token_data
+
     try:
         payload = jwt.decode(
             token=token,
-            key=settings.secret_key,
+            key=get_verification_key(token),
             algorithms=(settings.algorithm,)
         )
         phone = payload.get('sub')
         if phone is None:
             raise CredentialsException
-        token_data = PhoneScheme(phone=phone)
-    except JWTError:
+        token_data = TokenDataScheme(
+            phone=phone,
+            uid=payload.get('uid'),
+            is_active=payload.get('act'),
+            is_staff=payload.get('stf'),
+            version=payload.get('ver'),
+            jti=payload.get('jti'),
+            expire=payload.get('exp'),
+            kid=jwt.get_unverified_header(token).get('kid')
+            if is_asymmetric(settings.algorithm) else None,
+        )
+    except (JWTError, ValueError):
+        raise CredentialsException
+
+    expire = payload.get('exp')
+    if expire is not None:
+        token_cache.set(key, token_data, ttl=expire - time())
+    return token_data
+
+
+async def get_current_user(
+    db: AsyncSession = Depends(get_read_db),
+    token: str = Depends(oauth2_scheme),
+) -> UserSnapshot:
+    """Get a user by token.
+
+    #### Args:
+      - db (AsyncSession):
+        Connecting to the database.
+      - token (str):
+        JWT token.
+
+    #### Raises:
+      - CredentialsException:
+        The token is invalid, revoked or its version is outdated.
+
+    #### Returns:
+      - UserSnapshot:
+        The user data from the cache or the database.
+    """
+    token_data = decode_token(token)
+    if token_data.jti is not None and await revocations.is_revoked(
+        db, token_data.jti
+    ):
         raise CredentialsException
 
-    user = await orm.get_user_by_phone(db, int(token_data.phone))
-    if user is None:
+    phone = int(token_data.phone)
+    if token_data.uid is not None:
+        version = await orm.get_token_version(db, token_data.uid)
+        if version is None or version != token_data.version:
+            raise CredentialsException
+
+    user = user_cache.get(phone)
+    if user is not None:
+        return user
+
+    if token_data.uid is not None:
+        db_user = await orm.get_auth_user(db, id=token_data.uid)
+    else:
+        db_user = await orm.get_auth_user(db, phone=phone)
+    if db_user is None:
         raise CredentialsException
 
+    user = UserSnapshot.from_orm(db_user)
+    user_cache.set(phone, user)
     return user
 
 
 async def get_active_user(
-    user: UserTable = Depends(get_current_user)
-) -> UserTable:
+    user: UserSnapshot = Depends(get_current_user)
+) -> UserSnapshot:
     """Get the user if it is not deactivated.
 
     #### Args:
-      - user (UserTable):
-        The user object from the database.
+      - user (UserSnapshot):
+        The user data.
 
     #### Raises:
       - NotActiveUserException:
         The user is not active.
 
     #### Returns:
-      - UserTable:
-        The user object from the database.
+      - UserSnapshot:
+        The user data.
     """
     if not user.is_active:
         raise NotActiveUserException
 
     return user
+
+
+async def get_staff_user(
+    user: UserSnapshot = Depends(get_active_user)
+) -> UserSnapshot:
+    """Get the user if it is an active staff member.
+
+    #### Args:
+      - user (UserSnapshot):
+        The user data.
+
+    #### Raises:
+      - NotStaffUserException:
+        The user is not staff.
+
+    #### Returns:
+      - UserSnapshot:
+        The user data.
+    """
+    if not user.is_staff:
+        raise NotStaffUserException
+
+    return user
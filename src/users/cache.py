@@ -0,0 +1,72 @@
+from dataclasses import dataclass
+from typing import Any, Hashable
+
+from src.config import settings
+from src.core.cache import LRUCache
+
+
+@dataclass(frozen=True, slots=True)
+class UserSnapshot:
+    """The fields of a user which are needed by authenticated endpoints.
+    """
+    id: int
+    username: str
+    phone: int
+    is_active: bool
+    is_staff: bool
+
+    @classmethod
+    def from_orm(cls, user: Any) -> 'UserSnapshot':
+        return cls(
+            id=user.id,
+            username=user.username,
+            phone=user.phone,
+            is_active=user.is_active,
+            is_staff=user.is_staff,
+        )
+
+
+class UserCache(LRUCache):
+    """Snapshots of users by phone number.
+
+    Keeps an index by user ID, so writes which know only the ID
+    can invalidate the entry.
+    """
+    def __init__(self, maxsize: int, ttl: float | None = None) -> None:
+        super().__init__(maxsize, ttl)
+        self._phones: dict[int, int] = {}
+
+    def set(
+        self, key: Hashable, value: UserSnapshot, ttl: float | None = None
+    ) -> None:
+        super().set(key, value, ttl)
+        if key in self._data:
+            self._phones[value.id] = key
+
+    def _delete(self, key: Hashable) -> UserSnapshot:
+        user = super()._delete(key)
+        if self._phones.get(user.id) == key:
+            del self._phones[user.id]
+        return user
+
+    def invalidate_id(self, user_id: int) -> None:
+        """Remove the snapshot of the user with the ID.
+
+        #### Args:
+          - user_id (int):
+            User ID.
+        """
+        phone = self._phones.get(user_id)
+        if phone is not None:
+            self.pop(phone)
+
+    def clear(self) -> None:
+        super().clear()
+        self._phones.clear()
+
+
+user_cache = UserCache(settings.user_cache_size, settings.user_cache_ttl)
+
+# Token versions by user ID, to check self-contained tokens without
+# reading the database.
+token_versions = LRUCache(settings.user_cache_size, settings.user_cache_ttl)
@@ -0,0 +1,87 @@
+"""Find the `bcrypt` cost for the target latency on this host.
+
+Run from the root of the project:
+
+    python -m src.users.calibrate [--target-ms 100]
+
+Put the recommended value into `.env` as `BCRYPT_ROUNDS`. Hashes with
+fewer rounds are rehashed when the users log in.
+"""
+import argparse
+from statistics import median
+from time import perf_counter
+
+from passlib.hash import bcrypt
+
+PASSWORD = 'calibration-password'
+
+
+def measure(rounds: int, samples: int = 3) -> float:
+    """Get the median time of hashing with the rounds.
+
+    #### Args:
+      - rounds (int):
+        The `bcrypt` cost, the work is `2 ** rounds`.
+      - samples (int): Default 3.
+        Number of measurements.
+
+    #### Returns:
+      - float:
+        Seconds per hash.
+    """
+    handler = bcrypt.using(rounds=rounds)
+    timings = []
+    for _ in range(samples):
+        start = perf_counter()
+        handler.hash(PASSWORD)
+        timings.append(perf_counter() - start)
+    return median(timings)
+
+
+def recommend_rounds(
+    target: float, samples: int = 3
+) -> tuple[int, dict[int, float]]:
+    """Get the highest rounds which hash not slower than the target.
+
+    Every extra round doubles the time, so the measuring stops
+    at the first value over the target.
+
+    #### Args:
+      - target (float):
+        Seconds per hash.
+      - samples (int): Default 3.
+        Number of measurements of every value.
+
+    #### Returns:
+      - tuple[int, dict[int, float]]:
+        The recommended rounds, at least the minimum of `bcrypt`,
+        and the seconds per hash of every measured value.
+    """
+    measure(bcrypt.min_rounds, 1)  # load the backend of `bcrypt`
+    timings = {}
+    recommended = bcrypt.min_rounds
+    for rounds in range(bcrypt.min_rounds, bcrypt.max_rounds + 1):
+        timings[rounds] = measure(rounds, samples)
+        if timings[rounds] > target:
+            break
+        recommended = rounds
+    return recommended, timings
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        '--target-ms', type=float, default=100,
+        help='acceptable time of one hash, default 100',
+    )
+    parser.add_argument('--samples', type=int, default=3)
+    args = parser.parse_args()
+
+    rounds, timings = recommend_rounds(args.target_ms / 1000, args.samples)
+    for value, seconds in timings.items():
+        print(f'rounds={value:>2}: {seconds * 1000:8.1f} ms')
+    print(f'BCRYPT_ROUNDS={rounds}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+import csv
+import io
+import json
+from typing import AsyncIterator
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.users.models import UserTable, orm
+
+EXPORT_COLUMNS = [
+    UserTable.id,
+    UserTable.username,
+    UserTable.phone,
+    UserTable.is_active,
+    UserTable.is_staff,
+]
+EXPORT_MEDIA_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+async def export_ndjson(
+    db: AsyncSession, chunk_size: int
+) -> AsyncIterator[bytes]:
+    """Stream all users as JSON objects, one per line.
+
+    #### Args:
+      - db (AsyncSession):
+        Connecting to the database.
+      - chunk_size (int):
+        Number of users read from the database at once.
+    """
+    async for chunk in orm.iter_chunks(db, EXPORT_COLUMNS, chunk_size):
+        yield ''.join(
+            json.dumps(row._asdict(), ensure_ascii=False) + '\n'
+            for row in chunk
+        ).encode()
+
+
+async def export_csv(
+    db: AsyncSession, chunk_size: int
+) -> AsyncIterator[bytes]:
+    """Stream all users as CSV with the header.
+
+    #### Args:
+      - db (AsyncSession):
+        Connecting to the database.
+      - chunk_size (int):
+        Number of users read from the database at once.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(column.key for column in EXPORT_COLUMNS)
+    async for chunk in orm.iter_chunks(db, EXPORT_COLUMNS, chunk_size):
+        writer.writerows(chunk)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+EXPORTERS = {
+    'ndjson': export_ndjson,
+    'csv': export_csv,
+}
@@ -0,0 +1,170 @@
+import asyncio
+from time import perf_counter
+
+from passlib.context import CryptContext
+
+from src.config import settings
+from src.core.executors import BoundedProcessPool
+from src.core.metrics import PASSWORD_HASH_DURATION
+
+# Passwords hashed by one job of `hash_many`. Jobs are small, so logins
+# wait for at most one of them instead of the whole import.
+HASH_CHUNK_SIZE = 4
+
+# Hashes with fewer rounds are rehashed when the user logs in.
+pwd_context = CryptContext(
+    schemes=['bcrypt'],
+    deprecated='auto',
+    bcrypt__default_rounds=settings.bcrypt_rounds,
+    bcrypt__min_rounds=settings.bcrypt_rounds,
+)
+
+
+def verify_password(password: str, hash_password: str) -> bool:
+    """Check the password and hash password match.
+
+    #### Args:
+      - password (str):
+        The password for verification.
+      - hash_password (str):
+        The password hash from the database.
+
+    #### Returns:
+      - bool:
+        Does the password and hash password match.
+    """
+    return pwd_context.verify(secret=password, hash=hash_password)
+
+
+def get_hash_password(password: str) -> str:
+    """Get a hash from a password.
+
+    #### Args:
+      - password (str):
+        Password for hashing.
+
+    #### Returns:
+      - str:
+        The hash of the password.
+    """
+    return pwd_context.hash(secret=password)
+
+
+def get_hash_passwords(passwords: list[str]) -> list[str]:
+    """Get hashes of the passwords.
+
+    #### Args:
+      - passwords (list[str]):
+        Passwords for hashing.
+
+    #### Returns:
+      - list[str]:
+        Hashes in the same order.
+    """
+    return [pwd_context.hash(secret=password) for password in passwords]
+
+
+class PasswordHasher:
+    """Awaitable password hashing in a process pool.
+
+    `bcrypt` takes tens of milliseconds per call, so it must not run
+    on the event loop.
+    """
+    def __init__(self, pool: BoundedProcessPool) -> None:
+        self.pool = pool
+
+    async def hash(self, password: str) -> str:
+        """Get a hash from a password.
+
+        #### Args:
+          - password (str):
+            Password for hashing.
+
+        #### Returns:
+          - str:
+            The hash of the password.
+        """
+        start = perf_counter()
+        hash_password = await self.pool.run(get_hash_password, password)
+        PASSWORD_HASH_DURATION.observe(perf_counter() - start, 'hash')
+        return hash_password
+
+    async def verify(self, password: str, hash_password: str) -> bool:
+        """Check the password and hash password match.
+
+        #### Args:
+          - password (str):
+            The password for verification.
+          - hash_password (str):
+            The password hash from the database.
+
+        #### Returns:
+          - bool:
+            Does the password and hash password match.
+        """
+        start = perf_counter()
+        verified = await self.pool.run(
+            verify_password, password, hash_password
+        )
+        PASSWORD_HASH_DURATION.observe(perf_counter() - start, 'verify')
+        return verified
+
+    def needs_update(self, hash_password: str) -> bool:
+        """Check that the hash uses an outdated scheme or too few rounds.
+
+        It only parses the hash, so it does not need the pool.
+
+        #### Args:
+          - hash_password (str):
+            The password hash from the database.
+
+        #### Returns:
+          - bool:
+            Does the password need to be hashed again.
+        """
+        return pwd_context.needs_update(hash_password)
+
+    async def hash_many(self, passwords: list[str]) -> list[str]:
+        """Get hashes of the passwords using all worker processes.
+
+        Passwords are hashed in chunks of `HASH_CHUNK_SIZE`, and only one
+        chunk per worker is submitted at a time. Jobs of `verify` and
+        `hash` submitted meanwhile are queued before the next chunks.
+
+        #### Args:
+          - passwords (list[str]):
+            Passwords for hashing.
+
+        #### Returns:
+          - list[str]:
+            Hashes in the same order.
+        """
+        if not passwords:
+            return []
+
+        start = perf_counter()
+        chunks = [
+            passwords[i:i + HASH_CHUNK_SIZE]
+            for i in range(0, len(passwords), HASH_CHUNK_SIZE)
+        ]
+        hashes: list[list[str]] = [[] for _ in chunks]
+        turns = iter(range(len(chunks)))
+
+        async def worker() -> None:
+            for i in turns:
+                hashes[i] = await self.pool.run(get_hash_passwords, chunks[i])
+
+        await asyncio.gather(*(
+            worker()
+            for _ in range(min(max(self.pool.max_workers, 1), len(chunks)))
+        ))
+        PASSWORD_HASH_DURATION.observe(perf_counter() - start, 'hash_many')
+        return [hash_password for chunk in hashes for hash_password in chunk]
+
+    def shutdown(self) -> None:
+        self.pool.shutdown()
+
+
+hasher = PasswordHasher(
+    BoundedProcessPool(settings.hash_pool_size, settings.hash_queue_size)
+)
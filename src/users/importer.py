@@ -0,0 +1,163 @@
+import csv
+import json
+from typing import AsyncIterator
+
+from pydantic import ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.users.hashing import hasher
+from src.users.models import orm
+from src.users.schemes import (
+    CreateUserScheme,
+    DbUserScheme,
+    ImportErrorScheme,
+    ImportReportScheme,
+)
+
+Row = dict | str  # the data of a row or the error of parsing
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Split the stream into text lines without reading it whole.
+
+    #### Args:
+      - chunks (AsyncIterator[bytes]):
+        The stream in `utf-8`.
+    """
+    tail = b''
+    async for chunk in chunks:
+        lines = (tail + chunk).split(b'\n')
+        tail = lines.pop()
+        for line in lines:
+            yield line.decode('utf-8', errors='replace').rstrip('\r')
+    if tail:
+        yield tail.decode('utf-8', errors='replace').rstrip('\r')
+
+
+async def iter_ndjson(chunks: AsyncIterator[bytes]) -> AsyncIterator[Row]:
+    """Parse a stream of JSON objects, one per line.
+
+    #### Args:
+      - chunks (AsyncIterator[bytes]):
+        The stream in `utf-8`.
+    """
+    async for line in iter_lines(chunks):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield 'Invalid JSON'
+            continue
+        yield row if isinstance(row, dict) else 'Expected a JSON object'
+
+
+async def iter_csv(chunks: AsyncIterator[bytes]) -> AsyncIterator[Row]:
+    """Parse a stream of CSV rows, the first row is the header.
+
+    Quoted values must not contain line breaks.
+
+    #### Args:
+      - chunks (AsyncIterator[bytes]):
+        The stream in `utf-8`.
+    """
+    header = None
+    async for line in iter_lines(chunks):
+        if not line.strip():
+            continue
+        values = next(csv.reader([line]))
+        if header is None:
+            header = [name.strip() for name in values]
+            continue
+        if len(values) != len(header):
+            yield 'Wrong number of values'
+            continue
+        yield dict(zip(header, values))
+
+
+def _validation_error(err: ValidationError) -> str:
+    return '; '.join(
+        '.'.join(map(str, error['loc'])) + ': ' + error['msg']
+        for error in err.errors()
+    )
+
+
+async def _import_batch(
+    db: AsyncSession,
+    batch: list[tuple[int, CreateUserScheme]],
+    report: ImportReportScheme,
+) -> None:
+    users = [
+        {'username': user.username, 'phone': user.phone}
+        for _, user in batch
+    ]
+    errors = await orm.find_conflicts(db, users)
+    new_users = [
+        (user, new_user)
+        for (_, new_user), user, err in zip(batch, users, errors)
+        if err is None
+    ]
+    hashes = await hasher.hash_many(
+        [new_user.password for _, new_user in new_users]
+    )
+    for (user, _), hash_password in zip(new_users, hashes):
+        user |= DbUserScheme(
+            **user, password=hash_password, is_active=True
+        ).dict(exclude={'id'})
+
+    errors = await orm.bulk_create(db, users, errors)
+    for (number, _), err in zip(batch, errors):
+        if err is None:
+            report.created += 1
+        else:
+            report.errors.append(
+                ImportErrorScheme(row=number, error=f'The {err} is busy')
+            )
+
+
+async def import_users(
+    db: AsyncSession, rows: AsyncIterator[Row], batch_size: int
+) -> ImportReportScheme:
+    """Create users from the stream of rows in batches.
+
+    Passwords of a batch are hashed in parallel, then the batch
+    is inserted with one statement.
+
+    #### Args:
+      - db (AsyncSession):
+        Connecting to the database.
+      - rows (AsyncIterator[Row]):
+        Users data with `username`, `phone` and `password`.
+      - batch_size (int):
+        Number of users inserted at once.
+
+    #### Returns:
+      - ImportReportScheme:
+        Number of created users and the rows which are not imported.
+    """
+    report = ImportReportScheme()
+    batch: list[tuple[int, CreateUserScheme]] = []
+    number = 0
+    async for row in rows:
+        number += 1
+        if isinstance(row, str):
+            report.errors.append(ImportErrorScheme(row=number, error=row))
+            continue
+        try:
+            user = CreateUserScheme(**(row | {'avatar': None}))
+        except ValidationError as err:
+            report.errors.append(
+                ImportErrorScheme(row=number, error=_validation_error(err))
+            )
+            continue
+
+        batch.append((number, user))
+        if len(batch) >= batch_size:
+            await _import_batch(db, batch, report)
+            batch = []
+
+    if batch:
+        await _import_batch(db, batch, report)
+    # Conflicts of a batch are found after the invalid rows read later.
+    report.errors.sort(key=lambda error: error.row)
+    return report
@@ -0,0 +1,155 @@
+import json
+from base64 import urlsafe_b64encode
+from dataclasses import dataclass
+from hashlib import sha256
+from pathlib import Path
+from time import time
+from typing import Any
+
+from jose import jwk
+from jose.backends.base import Key
+from jose.constants import ALGORITHMS
+from jose.exceptions import JWKError
+
+from src.config import settings
+from src.core.storage import ObjectStat
+
+# Algorithms of signing supported by `python-jose`.
+ASYMMETRIC_ALGORITHMS = ALGORITHMS.RSA_DS | ALGORITHMS.EC_DS
+SIGNING_ALGORITHMS = ALGORITHMS.HMAC | ASYMMETRIC_ALGORITHMS
+
+# Members of the public key in its RFC 7638 thumbprint.
+THUMBPRINT_MEMBERS = {
+    'RSA': ('e', 'kty', 'n'),
+    'EC': ('crv', 'kty', 'x', 'y'),
+}
+
+
+@dataclass(frozen=True, slots=True)
+class SigningKey:
+    """A parsed private key and its public JWK.
+    """
+    kid: str
+    private_key: Key
+    public_key: Key
+    public_jwk: dict[str, Any]
+
+
+def thumbprint(public_jwk: dict[str, Any]) -> str:
+    """Get the RFC 7638 thumbprint of the public key, used as `kid`.
+    """
+    members = {
+        name: public_jwk[name]
+        for name in THUMBPRINT_MEMBERS[public_jwk['kty']]
+    }
+    digest = sha256(
+        json.dumps(members, separators=(',', ':'), sort_keys=True).encode()
+    ).digest()
+    return urlsafe_b64encode(digest).rstrip(b'=').decode()
+
+
+def load_key(pem: str, algorithm: str) -> SigningKey:
+    """Parse a private key in PEM.
+
+    #### Args:
+      - pem (str):
+        The private key.
+      - algorithm (str):
+        The algorithm of signing, like `RS256`.
+
+    #### Raises:
+      - ValueError:
+        The key is invalid. The message does not include the key.
+
+    #### Returns:
+      - SigningKey:
+        The parsed key.
+    """
+    try:
+        private_key = jwk.construct(pem, algorithm)
+    except JWKError:
+        # The message of `JWKError` contains the whole PEM.
+        raise ValueError(f'Invalid private key for {algorithm}') from None
+    public_key = private_key.public_key()
+    public_jwk = public_key.to_dict()
+    kid = thumbprint(public_jwk)
+    return SigningKey(
+        kid=kid,
+        private_key=private_key,
+        public_key=public_key,
+        public_jwk=public_jwk | {'kid': kid, 'use': 'sig'},
+    )
+
+
+class KeyRing:
+    """Keys for asymmetric signing of tokens.
+
+    The first key signs new tokens, the others only verify tokens
+    which were signed before the rotation. Keys are parsed once,
+    the public keys are serialized as a JSON Web Key Set once.
+    """
+    def __init__(self, pems: list[str], algorithm: str) -> None:
+        """
+        #### Args:
+          - pems (list[str]):
+            Private keys in PEM, the current key first.
+          - algorithm (str):
+            The algorithm of signing, like `RS256`.
+        """
+        self.load(pems, algorithm)
+
+    def load(self, pems: list[str], algorithm: str) -> None:
+        """Replace the keys, for example after a rotation.
+
+        #### Args:
+          - pems (list[str]):
+            Private keys in PEM, the current key first.
+          - algorithm (str):
+            The algorithm of signing, like `RS256`.
+
+        #### Raises:
+          - ValueError:
+            The algorithm is not supported, an asymmetric algorithm
+            has no keys or a key is invalid.
+        """
+        if algorithm not in SIGNING_ALGORITHMS:
+            raise ValueError(f'Unsupported algorithm of signing: {algorithm}')
+        if is_asymmetric(algorithm) and not pems:
+            raise ValueError(f'{algorithm} needs JWT_PRIVATE_KEY_FILES')
+        keys = [load_key(pem, algorithm) for pem in pems]
+        jwks = json.dumps(
+            {'keys': [key.public_jwk for key in keys]}, separators=(',', ':')
+        ).encode()
+        self.algorithm = algorithm
+        self.keys = keys
+        self._by_kid = {key.kid: key for key in keys}
+        self.jwks = jwks
+        self.jwks_stat = ObjectStat(
+            len(jwks), time(), '"%s"' % sha256(jwks).hexdigest()
+        )
+
+    @classmethod
+    def from_files(cls, paths: list[str], algorithm: str) -> 'KeyRing':
+        return cls([Path(path).read_text() for path in paths], algorithm)
+
+    @property
+    def current(self) -> SigningKey:
+        """The key which signs new tokens.
+        """
+        return self.keys[0]
+
+    def get(self, kid: str | None) -> SigningKey | None:
+        """Get the key by the `kid` header of a token.
+        """
+        return self._by_kid.get(kid)
+
+
+def is_asymmetric(algorithm: str) -> bool:
+    return algorithm in ASYMMETRIC_ALGORITHMS
+
+
+key_ring = KeyRing.from_files(
+    settings.jwt_private_key_files if is_asymmetric(settings.algorithm)
+    else [],
+    settings.algorithm,
+)
@@ -1,8 +1,19 @@
-from sqlalchemy import Boolean, Column, Integer, String, select
+from sqlalchemy import (
+    Boolean,
+    Column,
+    Index,
+    Integer,
+    Row,
+    String,
+    lambda_stmt,
+    select,
+    update,
+)
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.db.crud import CRUD
 from src.db.database import Base
+from src.users.cache import UserSnapshot, token_versions, user_cache
 
 
 class UserTable(Base):
@@ -14,6 +25,34 @@ class UserTable(Base):
     password = Column(String(128), name='password', nullable=False)
     is_active = Column(Boolean, default=False, nullable=False)
     is_staff = Column(Boolean, default=False, nullable=False)
+    # Bumped to revoke the self-contained tokens of the user.
+    token_version = Column(
+        Integer, default=0, server_default='0', nullable=False
+    )
+
+    __table_args__ = (
+        # Keyset pages filtered by a flag are read in `id` order.
+        Index('ix_user_is_active_id', 'is_active', 'id'),
+        Index('ix_user_is_staff_id', 'is_staff', 'id'),
+    )
+
+
+class RevokedTokenTable(Base):
+    __tablename__ = 'revoked_token'
+
+    jti = Column(String(32), primary_key=True)
+    expires_at = Column(Integer, index=True, nullable=False)  # Unix time
+
+
+SNAPSHOT_COLUMNS = [
+    UserTable.id,
+    UserTable.username,
+    UserTable.phone,
+    UserTable.is_active,
+    UserTable.is_staff,
+]
+# Changes of these columns revoke the self-contained tokens.
+REVOKING_COLUMNS = {'phone', 'password', 'is_active', 'is_staff'}
 
 
 class UserCRUD(CRUD):
@@ -24,6 +63,79 @@ class UserCRUD(CRUD):
     ) -> tuple[UserTable, None] | tuple[None, str]:
         return await super().create(db, new_obj, refresh)
 
+    async def update(
+        self, db: AsyncSession, obj_id: int, update_data: dict
+    ) -> None | str:
+        err = await super().update(db, obj_id, update_data)
+        user_cache.invalidate_id(obj_id)
+        return err
+
+    async def update_returning(
+        self, db: AsyncSession, obj_id: int, update_data: dict
+    ) -> tuple[Row | None, None] | tuple[None, str]:
+        """Update the user and put the new snapshot into `user_cache`.
+
+        A change of `REVOKING_COLUMNS` bumps `token_version`.
+
+        #### Args:
+          - db (AsyncSession):
+            Connecting to the database.
+          - obj_id (int):
+            ID of the user.
+          - update_data (dict):
+            Updated data.
+
+        #### Returns:
+          - tuple[Row | None, None] | tuple[None, str]:
+            The columns of `UserSnapshot`, None if there is no such user,
+            or (None, error description) if the update is not successful.
+        """
+        if REVOKING_COLUMNS.intersection(update_data):
+            update_data = update_data | {
+                'token_version': UserTable.token_version + 1
+            }
+        user, err = await super().update_returning(
+            db,
+            obj_id,
+            update_data,
+            [*SNAPSHOT_COLUMNS, UserTable.token_version],
+        )
+        user_cache.invalidate_id(obj_id)
+        token_versions.pop(obj_id)
+        if user is not None:
+            user_cache.set(user.phone, UserSnapshot.from_orm(user))
+            token_versions.set(user.id, user.token_version)
+        return user, err
+
+    async def replace_password(
+        self, db: AsyncSession, id: int, old_hash: str, new_hash: str
+    ) -> bool:
+        """Replace the password hash if it was not changed meanwhile.
+
+        The token version is kept, the password itself is the same.
+
+        #### Args:
+          - db (AsyncSession):
+            Connecting to the database.
+          - id (int):
+            User ID.
+          - old_hash (str):
+            The hash which was verified.
+          - new_hash (str):
+            The new hash of the same password.
+
+        #### Returns:
+          - bool:
+            Is the hash replaced.
+        """
+        result = await db.execute(
+            update(UserTable).where(
+                UserTable.id == id, UserTable.password == old_hash
+            ).values(password=new_hash)
+        )
+        await db.commit()
+        return bool(result.rowcount)
+
     async def get(self, db: AsyncSession, id: int) -> UserTable | None:
         return await super().get(db, id)
 
@@ -46,5 +158,144 @@ class UserCRUD(CRUD):
             select(self.model).where(UserTable.phone == phone).limit(1)
         )
 
+    async def get_page(
+        self,
+        db: AsyncSession,
+        after: int = 0,
+        limit: int = 50,
+        is_active: bool | None = None,
+        is_staff: bool | None = None,
+        username_prefix: str | None = None,
+    ) -> list[UserTable]:
+        """Get a page of users ordered by ID.
+
+        The page starts after the given ID (keyset pagination),
+        so the query uses the index and does not skip rows like `OFFSET`.
+
+        #### Args:
+          - db (AsyncSession):
+            Connecting to the database.
+          - after (int): Default 0.
+            ID of the last user of the previous page.
+          - limit (int): Default 50.
+            Max number of users on the page.
+          - is_active (bool | None): Default None.
+            Filter by the activity of users.
+          - is_staff (bool | None): Default None.
+            Filter by the staff status of users.
+          - username_prefix (str | None): Default None.
+            Filter by the beginning of usernames, case-sensitive.
+
+        #### Returns:
+          - list[UserTable]:
+            Users of the page.
+        """
+        query = select(self.model).where(UserTable.id > after)
+        if is_active is not None:
+            query = query.where(UserTable.is_active == is_active)
+        if is_staff is not None:
+            query = query.where(UserTable.is_staff == is_staff)
+        if username_prefix:
+            # A range instead of `LIKE` can use the index of `username`.
+            query = query.where(
+                UserTable.username >= username_prefix,
+                UserTable.username < username_prefix + '\U0010ffff',
+            )
+        return list(await db.scalars(
+            query.order_by(UserTable.id).limit(limit)
+        ))
+
+    async def get_auth_user(
+        self, db: AsyncSession, id: int | None = None, phone: int | None = None
+    ) -> Row | None:
+        """Get the fields of `UserSnapshot` by ID or phone number.
+
+        The statements are `lambda_stmt`, so they are built and compiled
+        once, not on every authenticated request.
+
+        #### Args:
+          - db (AsyncSession):
+            Connecting to the database.
+          - id (int | None): Default None.
+            User ID.
+          - phone (int | None): Default None.
+            User's phone number, used if the ID is None.
+
+        #### Returns:
+          - Row | None:
+            The row if the user exists else None.
+        """
+        if id is not None:
+            stmt = lambda_stmt(lambda: select(
+                UserTable.id,
+                UserTable.username,
+                UserTable.phone,
+                UserTable.is_active,
+                UserTable.is_staff,
+            ).where(UserTable.id == id))
+        else:
+            stmt = lambda_stmt(lambda: select(
+                UserTable.id,
+                UserTable.username,
+                UserTable.phone,
+                UserTable.is_active,
+                UserTable.is_staff,
+            ).where(UserTable.phone == phone).limit(1))
+        return (await db.execute(stmt)).first()
+
+    async def get_credentials(
+        self, db: AsyncSession, phone: int
+    ) -> Row | None:
+        """Get the fields needed to log in by phone number.
+
+        #### Args:
+          - db (AsyncSession):
+            Connecting to the database.
+          - phone (int):
+            User's phone number.
+
+        #### Returns:
+          - Row | None:
+            The columns of `UserSnapshot`, `password` and `token_version`
+            if the user exists else None.
+        """
+        stmt = lambda_stmt(lambda: select(
+            UserTable.id,
+            UserTable.username,
+            UserTable.phone,
+            UserTable.is_active,
+            UserTable.is_staff,
+            UserTable.password,
+            UserTable.token_version,
+        ).where(UserTable.phone == phone).limit(1))
+        return (await db.execute(stmt)).first()
+
+    async def get_token_version(
+        self, db: AsyncSession, id: int
+    ) -> int | None:
+        """Get the token version of the user.
+
+        Uses `token_versions` and reads the database only on a miss.
+
+        #### Args:
+          - db (AsyncSession):
+            Connecting to the database.
+          - id (int):
+            User ID.
+
+        #### Returns:
+          - int | None:
+            The version if the user exists else None.
+        """
+        version = token_versions.get(id)
+        if version is None:
+            stmt = lambda_stmt(lambda: select(
+                UserTable.token_version
+            ).where(UserTable.id == id))
+            version = await db.scalar(stmt)
+            if version is not None:
+                token_versions.set(id, version)
+        return version
+
 
 orm = UserCRUD(UserTable)
@@ -0,0 +1,149 @@
+import asyncio
+from time import monotonic, time
+
+from sqlalchemy import delete, insert, lambda_stmt, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.config import settings
+from src.core.bloom import BloomFilter
+from src.core.cache import LRUCache
+from src.users.models import RevokedTokenTable
+
+
+class RevocationList:
+    """Revoked tokens by `jti`.
+
+    The ids are stored in the database and loaded into a Bloom filter,
+    so a token which is not revoked is checked in memory. Only hits of
+    the filter are checked in the database. The filter is reloaded
+    every `refresh` seconds to see revocations of other processes
+    and to drop expired tokens.
+    """
+    def __init__(self, capacity: int, refresh: float) -> None:
+        self.capacity = capacity
+        self.refresh = refresh
+        self.filter = BloomFilter(capacity)
+        self.revoked = LRUCache(capacity)  # exact results of the hits
+        self._loaded_at: float | None = None
+        self._lock = asyncio.Lock()
+        # Revoked while the filter is reloaded, added to the new filter.
+        self._revoked_in_load: list[str] | None = None
+
+    def clear(self) -> None:
+        self.filter = BloomFilter(self.capacity)
+        self.revoked.clear()
+        self._loaded_at = None
+
+    async def load(self, db: AsyncSession) -> None:
+        """Rebuild the filter from the tokens which are not expired.
+
+        #### Args:
+          - db (AsyncSession):
+            Connecting to the database.
+        """
+        now = int(time())
+        self._revoked_in_load = []
+        try:
+            result = await db.stream_scalars(
+                select(RevokedTokenTable.jti).where(
+                    RevokedTokenTable.expires_at > now
+                )
+            )
+            bloom_filter = BloomFilter(self.capacity)
+            async for jti in result:
+                bloom_filter.add(jti)
+            for jti in self._revoked_in_load:
+                bloom_filter.add(jti)
+        finally:
+            self._revoked_in_load = None
+        self.filter = bloom_filter
+        self._loaded_at = monotonic()
+
+    async def _ensure_loaded(self, db: AsyncSession) -> None:
+        if self._loaded_at is not None and (
+            monotonic() - self._loaded_at < self.refresh
+        ):
+            return
+
+        async with self._lock:
+            if self._loaded_at is None or (
+                monotonic() - self._loaded_at >= self.refresh
+            ):
+                await self.load(db)
+
+    async def is_revoked(self, db: AsyncSession, jti: str) -> bool:
+        """Check that the token is revoked.
+
+        #### Args:
+          - db (AsyncSession):
+            Connecting to the database.
+          - jti (str):
+            ID of the token.
+
+        #### Returns:
+          - bool:
+            Is the token revoked.
+        """
+        await self._ensure_loaded(db)
+        if jti not in self.filter:
+            return False
+
+        revoked = self.revoked.get(jti)
+        if revoked is None:
+            now = int(time())
+            stmt = lambda_stmt(lambda: select(
+                RevokedTokenTable.expires_at
+            ).where(
+                RevokedTokenTable.jti == jti,
+                RevokedTokenTable.expires_at > now,
+            ))
+            expires_at = await db.scalar(stmt)
+            revoked = expires_at is not None
+            ttl = expires_at - now if revoked else self.refresh
+            self.revoked.set(jti, revoked, ttl)
+        return revoked
+
+    async def revoke(
+        self, db: AsyncSession, jti: str, expires_at: int
+    ) -> None:
+        """Revoke the token until it expires.
+
+        Expired tokens are deleted from the database at the same time.
+
+        #### Args:
+          - db (AsyncSession):
+            Connecting to the primary database.
+          - jti (str):
+            ID of the token.
+          - expires_at (int):
+            Unix time of the expiration of the token.
+        """
+        now = int(time())
+        if expires_at <= now:
+            return
+
+        await db.execute(
+            delete(RevokedTokenTable).where(
+                RevokedTokenTable.expires_at <= now
+            )
+        )
+        try:
+            await db.execute(
+                insert(RevokedTokenTable).values(
+                    jti=jti, expires_at=expires_at
+                )
+            )
+            await db.commit()
+        except IntegrityError:
+            await db.rollback()
+
+        self.filter.add(jti)
+        if self._revoked_in_load is not None:
+            self._revoked_in_load.append(jti)
+        self.revoked.set(jti, True, expires_at - now)
+
+
+revocations = RevocationList(
+    settings.revocation_capacity, settings.revocation_refresh
+)
@@ -1,33 +1,72 @@
-from pathlib import Path
-
-from fastapi import APIRouter, BackgroundTasks, Depends, status
+from fastapi import (
+    APIRouter,
+    BackgroundTasks,
+    Depends,
+    Form,
+    Query,
+    Request,
+    Response,
+    status,
+)
+from fastapi.responses import FileResponse, StreamingResponse
+from pydantic import NonNegativeInt, PositiveInt
 from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
 
+from src.config import AVATAR_FORMATS, settings
 from src.core.exceptions import (
     AvatarException,
+    AvatarNotFoundException,
+    CredentialsException,
     InvalidLoginDataException,
+    ProfileNotFoundException,
+    UnsupportedMediaTypeException,
     UserExistException,
 )
-from src.core.services import Avatar, get_avatars_root
-from src.db.database import get_db
+from src.core.profiling import list_profiles, profile_path
+from src.core.responses import (
+    cached_content_response,
+    cached_object_response,
+)
+from src.core.services import Avatar, get_avatar_storage
+from src.core.storage import Storage
+from src.core.uploads import save_upload
+from src.db.database import get_db, get_read_db
 from src.users.authentication import (
     authenticate_user,
+    check_login_rate,
     create_access_token,
+    decode_token,
     get_active_user,
-    get_hash_password,
+    get_staff_user,
+    token_claims,
 )
+from src.users.cache import UserSnapshot
+from src.users.exporter import EXPORT_MEDIA_TYPES, EXPORTERS
 from src.users.forms import PhoneAuthForm
+from src.users.hashing import hasher
+from src.users.importer import import_users, iter_csv, iter_ndjson
+from src.users.keys import key_ring
 from src.users.models import UserTable, orm
+from src.users.revocation import revocations
 from src.users.schemes import (
     CreateUserScheme,
     DbUserScheme,
+    ImportReportScheme,
+    ProfileScheme,
     ResponseUserScheme,
+    StaffUserScheme,
     TokenScheme,
     UpdateUserScheme,
+    UsersPageScheme,
 )
 
 router = APIRouter()
 
+RESPONSE_COLUMNS = [
+    UserTable.id, UserTable.username, UserTable.phone, UserTable.is_active
+]
+
 
 @router.post(
     path='/registration',
@@ -39,22 +78,24 @@ router = APIRouter()
 async def sign(
     new_user: CreateUserScheme,
     background_tasks: BackgroundTasks,
-    avatars_dir: Path = Depends(get_avatars_root),
+    storage: Storage = Depends(get_avatar_storage),
     db: AsyncSession = Depends(get_db),
 ) -> None:
     db_user = DbUserScheme(
         username=new_user.username,
         phone=new_user.phone,
-        password=get_hash_password(new_user.password),
+        password=await hasher.hash(new_user.password),
         is_active=True,
     )
-    user, err = await orm.create(db, db_user.dict(), refresh=True)
+    user, err = await orm.create_returning(
+        db, db_user.dict(exclude={'id'}), RESPONSE_COLUMNS
+    )
     if err is not None:
         raise UserExistException(detail=err)
 
     if new_user.avatar is not None:
         avatar = await Avatar(
-            new_user.avatar, str(user.id), avatars_dir
+            new_user.avatar, str(user.id), storage
         )
         if avatar.image is None:
             raise AvatarException(status.HTTP_206_PARTIAL_CONTENT)
@@ -67,20 +108,72 @@ async def sign(
 @router.post(
     path='/token',
     response_model=TokenScheme,
-    summary='Obtaining an access token'
+    summary='Obtaining an access token',
+    dependencies=[Depends(check_login_rate)],
+    responses={
+        status.HTTP_429_TOO_MANY_REQUESTS: {
+            'description': 'Too many attempts, see `Retry-After`',
+        },
+    },
 )
 async def get_access_token(
+    background_tasks: BackgroundTasks,
     form: PhoneAuthForm = Depends(),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db),
+    write_db: AsyncSession = Depends(get_db),
 ) -> TokenScheme:
-    user = await authenticate_user(db, form.username, form.password)
+    user = await authenticate_user(
+        db, form.username, form.password, background_tasks, write_db
+    )
     if user is None:
         raise InvalidLoginDataException
 
-    access_token = create_access_token(data={'sub': str(user.phone)})
+    access_token = create_access_token(data=token_claims(user))
     return TokenScheme(access_token=access_token)
 
 
+@router.post(
+    path='/token/revoke',
+    summary='Revoke an access token',
+    description='The token can not be used after it. Invalid and expired '
+    'tokens are ignored.',
+)
+async def revoke_access_token(
+    token: str = Form(description='The access token to revoke.'),
+    db: AsyncSession = Depends(get_db),
+) -> None:
+    try:
+        token_data = decode_token(token)
+    except CredentialsException:
+        return None
+
+    if token_data.jti is not None and token_data.expire is not None:
+        await revocations.revoke(db, token_data.jti, token_data.expire)
+    return None
+
+
+@router.get(
+    path='/.well-known/jwks.json',
+    summary='Get the public keys of access tokens',
+    description='Services verify tokens signed with `RS*` or `ES*` '
+    'by these keys, matching the `kid` header of a token. The set is empty '
+    'if tokens are signed with a shared secret.',
+    response_class=Response,
+    responses={
+        status.HTTP_200_OK: {'content': {'application/json': {}}},
+        status.HTTP_304_NOT_MODIFIED: {'description': 'Not modified'},
+    },
+)
+async def read_jwks(request: Request) -> Response:
+    return cached_content_response(
+        request,
+        key_ring.jwks,
+        key_ring.jwks_stat,
+        'application/json',
+        settings.jwks_max_age,
+    )
+
+
 @router.get(
     path='/users/me',
     response_model=ResponseUserScheme,
@@ -88,16 +181,63 @@ async def get_access_token(
     response_model_exclude_none=True,
 )
 async def read_users_me(
-    current_user: UserTable = Depends(get_active_user),
-    avatars_dir: Path = Depends(get_avatars_root)
+    inline_avatar: bool = Query(
+        default=True,
+        description='Add the smallest avatar as `base64`. Use '
+        '`/users/{user_id}/avatar/{size}` to get avatars cached by clients.',
+    ),
+    current_user: UserSnapshot = Depends(get_active_user),
+    storage: Storage = Depends(get_avatar_storage)
 ):
     user = ResponseUserScheme.from_orm(current_user)
-    user.avatar = await Avatar.base64_min_avatar(
-        avatars_dir, str(current_user.id)
-    )
+    if inline_avatar:
+        user.avatar = await Avatar.base64_min_avatar(
+            storage, str(current_user.id)
+        )
     return user
 
 
+@router.get(
+    path='/users/{user_id}/avatar/{size}',
+    summary='Get the avatar of the user',
+    response_class=Response,
+    responses={
+        status.HTTP_200_OK: {
+            'content': {
+                media_type: {} for media_type in AVATAR_FORMATS.values()
+            },
+        },
+        status.HTTP_304_NOT_MODIFIED: {'description': 'Not modified'},
+        status.HTTP_404_NOT_FOUND: {'description': 'Avatar not found'},
+    },
+)
+async def read_user_avatar(
+    user_id: PositiveInt,
+    size: int,
+    request: Request,
+    storage: Storage = Depends(get_avatar_storage),
+) -> Response:
+    if size not in Avatar.widths:
+        raise AvatarNotFoundException
+
+    variant = await Avatar.select_variant(
+        storage, str(user_id), size, request.headers.get('accept')
+    )
+    if variant is None:
+        raise AvatarNotFoundException
+
+    key, stat, media_type = variant
+    return cached_object_response(
+        request,
+        storage,
+        key,
+        stat,
+        media_type,
+        settings.avatar_cache_max_age,
+        headers={'Vary': 'Accept'},
+    )
+
+
 @router.patch(
     path='/users/me',
     summary='Self-update the user',
@@ -106,16 +246,16 @@ async def read_users_me(
 async def update_users_me(
     update_data: UpdateUserScheme,
     background_tasks: BackgroundTasks,
-    current_user: UserTable = Depends(get_active_user),
+    current_user: UserSnapshot = Depends(get_active_user),
+    storage: Storage = Depends(get_avatar_storage),
     db: AsyncSession = Depends(get_db)
 ):
     if update_data.password:
-        update_data.password = get_hash_password(update_data.password)
+        update_data.password = await hasher.hash(update_data.password)
 
     if update_data.avatar is not None:
-        avatars_root = get_avatars_root()
         avatar = await Avatar(
-            update_data.avatar, str(current_user.id), avatars_root
+            update_data.avatar, str(current_user.id), storage
         )
         if avatar.image is None:
             raise AvatarException
@@ -124,8 +264,189 @@ async def update_users_me(
 
     update_dict = update_data.dict(exclude_none=True, exclude={'avatar'})
     if update_dict:
-        err = await orm.update(db, current_user.id, update_dict)
+        _, err = await orm.update_returning(db, current_user.id, update_dict)
         if err is not None:
             raise UserExistException(detail=err)
 
     return None
+
+
+@router.put(
+    path='/users/me/avatar',
+    summary='Upload the avatar of the user',
+    status_code=status.HTTP_202_ACCEPTED,
+    openapi_extra={
+        'requestBody': {
+            'required': True,
+            'content': {
+                'multipart/form-data': {
+                    'schema': {
+                        'type': 'object',
+                        'properties': {
+                            'avatar': {'type': 'string', 'format': 'binary'}
+                        },
+                    },
+                },
+                'image/*': {
+                    'schema': {'type': 'string', 'format': 'binary'}
+                },
+            },
+        },
+    },
+)
+async def upload_users_me_avatar(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    current_user: UserSnapshot = Depends(get_active_user),
+    storage: Storage = Depends(get_avatar_storage),
+):
+    image_file = await save_upload(request, settings.avatar_max_upload_bytes)
+    try:
+        avatar = await Avatar(
+            None, str(current_user.id), storage, image_file=image_file
+        )
+    finally:
+        image_file.unlink()
+
+    if avatar.image is None:
+        raise AvatarException
+
+    background_tasks.add_task(avatar.save_resized_avatars)
+    return None
+
+
+@router.post(
+    path='/users/import',
+    response_model=ImportReportScheme,
+    summary='Import users from CSV or NDJSON',
+    description='Only for staff. Every record must contain `username`, '
+    '`phone` and `password`. Rows which can not be imported are reported, '
+    'the others are created.',
+    openapi_extra={
+        'requestBody': {
+            'required': True,
+            'content': {
+                'text/csv': {'schema': {'type': 'string'}},
+                'application/x-ndjson': {'schema': {'type': 'string'}},
+            },
+        },
+    },
+)
+async def import_users_from_file(
+    request: Request,
+    staff_user: UserSnapshot = Depends(get_staff_user),
+    db: AsyncSession = Depends(get_db),
+) -> ImportReportScheme:
+    content_type = request.headers.get('content-type', '')
+    if content_type.startswith('text/csv'):
+        rows = iter_csv(request.stream())
+    elif content_type.startswith('application/x-ndjson'):
+        rows = iter_ndjson(request.stream())
+    else:
+        raise UnsupportedMediaTypeException(
+            detail='Expected `text/csv` or `application/x-ndjson`'
+        )
+
+    return await import_users(db, rows, settings.import_batch_size)
+
+
+@router.get(
+    path='/users/export',
+    summary='Export users as NDJSON or CSV',
+    description='Only for staff. Users are streamed in chunks, '
+    'passwords are not exported.',
+    response_class=StreamingResponse,
+    responses={
+        status.HTTP_200_OK: {
+            'content': {
+                media_type: {} for media_type in EXPORT_MEDIA_TYPES.values()
+            },
+        },
+    },
+)
+async def export_users(
+    file_format: str = Query(
+        default='ndjson', alias='format', regex='^(ndjson|csv)$'
+    ),
+    staff_user: UserSnapshot = Depends(get_staff_user),
+    db: AsyncSession = Depends(get_read_db),
+) -> StreamingResponse:
+    return StreamingResponse(
+        EXPORTERS[file_format](db, settings.export_chunk_size),
+        media_type=EXPORT_MEDIA_TYPES[file_format],
+        headers={
+            'Content-Disposition':
+                f'attachment; filename="users.{file_format}"',
+        },
+    )
+
+
+@router.get(
+    path='/users',
+    response_model=UsersPageScheme,
+    summary='Get a page of users',
+    description='Only for staff. Pass `next_after` of the response as '
+    '`after` to get the next page.',
+)
+async def read_users(
+    after: NonNegativeInt = Query(
+        default=0, description='ID of the last user of the previous page.'
+    ),
+    limit: int = Query(
+        default=settings.users_page_size,
+        ge=1,
+        le=settings.users_page_max_size,
+    ),
+    is_active: bool | None = None,
+    is_staff: bool | None = None,
+    username: str | None = Query(
+        default=None,
+        max_length=16,
+        description='The beginning of usernames, case-sensitive.',
+    ),
+    staff_user: UserSnapshot = Depends(get_staff_user),
+    db: AsyncSession = Depends(get_read_db),
+) -> UsersPageScheme:
+    users = await orm.get_page(
+        db, after, limit + 1, is_active, is_staff, username
+    )
+    next_after = users[limit - 1].id if len(users) > limit else None
+    return UsersPageScheme(
+        users=[StaffUserScheme.from_orm(user) for user in users[:limit]],
+        next_after=next_after,
+    )
+
+
+@router.get(
+    path='/profiles',
+    response_model=list[ProfileScheme],
+    summary='Get the saved profiles of requests',
+    description='Only for staff. Requests are profiled if they have '
+    'the `X-Profile` header with the configured token, or by sampling.',
+    tags=['Debug'],
+)
+async def read_profiles(
+    staff_user: UserSnapshot = Depends(get_staff_user),
+) -> list[ProfileScheme]:
+    profiles = await run_in_threadpool(list_profiles, settings.profiles_dir)
+    return [ProfileScheme.from_orm(profile) for profile in profiles]
+
+
+@router.get(
+    path='/profiles/{name}',
+    summary='Download a saved profile',
+    description='Only for staff. Open it with `python -m pstats`, '
+    '`snakeviz` or convert it for other viewers.',
+    response_class=FileResponse,
+    tags=['Debug'],
+)
+async def read_profile(
+    name: str,
+    staff_user: UserSnapshot = Depends(get_staff_user),
+) -> FileResponse:
+    path = await run_in_threadpool(profile_path, settings.profiles_dir, name)
+    if path is None:
+        raise ProfileNotFoundException
+    return FileResponse(
+        path, media_type='application/octet-stream', filename=name
+    )
@@ -1,3 +1,5 @@
+from datetime import datetime
+
 from pydantic import BaseModel, Field, PositiveInt, validator
 
 
@@ -22,6 +24,20 @@ class PhoneScheme(BaseModel):
     )
 
 
+class TokenDataScheme(PhoneScheme):
+    """Scheme for the verified claims of an access token
+
+    The optional fields are set in self-contained tokens only.
+    """
+    uid: PositiveInt | None = None
+    is_active: bool | None = None
+    is_staff: bool | None = None
+    version: int | None = None
+    jti: str | None = None
+    expire: int | None = None
+    kid: str | None = None  # the key of an asymmetric signature
+
+
 class BaseUserScheme(PhoneScheme):
     username: str = Field(
         title='User`s username',
@@ -130,7 +146,7 @@ class UpdateUserScheme(BaseModel):
 
     @validator('password')
     def simple_password_validator(cls, password: str | None) -> str | None:
-        if password is not None or len(set(password)) < len(password) >> 1:
+        if password is not None and len(set(password)) < len(password) >> 1:
             raise ValueError('Password is too simple')
         return password
 
@@ -139,3 +155,74 @@ class UpdateUserScheme(BaseModel):
         if avatar and len(avatar) != len(avatar) >> 2 << 2:
             raise ValueError('Avatar is invalid')
         return avatar
+
+
+class ImportErrorScheme(BaseModel):
+    """Scheme for a row which is not imported
+    """
+    row: PositiveInt = Field(
+        description='Number of the record, starting from 1. '
+        'The CSV header is not counted.',
+    )
+    error: str = Field(
+        description='Why the row is not imported.',
+    )
+
+
+class ImportReportScheme(BaseModel):
+    """Scheme for the result of importing users
+    """
+    created: int = Field(
+        default=0,
+        description='Number of created users.',
+    )
+    errors: list[ImportErrorScheme] = Field(
+        default=[],
+        description='Rows which are not imported.',
+    )
+
+
+class StaffUserScheme(BaseUserScheme):
+    """Scheme for data of user for staff
+    """
+    id: PositiveInt = Field(
+        description='User ID in database.',
+    )
+    is_active: bool = Field(
+        title='User is active',
+        description='Inactive user does not have authorization rights.',
+    )
+    is_staff: bool = Field(
+        title='User is staff',
+    )
+
+    class Config:
+        orm_mode = True
+
+
+class UsersPageScheme(BaseModel):
+    """Scheme for a page of users
+    """
+    users: list[StaffUserScheme] = Field(
+        description='Users ordered by ID.',
+    )
+    next_after: PositiveInt | None = Field(
+        default=None,
+        description='Value of `after` for the next page, '
+        'null if this page is the last.',
+    )
+
+
+class ProfileScheme(BaseModel):
+    """Scheme for a saved profile of a request
+    """
+    name: str = Field(
+        description='File name, starts with the time of the request.',
+    )
+    size: int = Field(
+        description='Size in bytes.',
+    )
+    created: datetime
+
+    class Config:
+        orm_mode = True
@@ -4,14 +4,21 @@ from pathlib import Path
 import pytest
 import pytest_asyncio
 from fastapi.testclient import TestClient
+from sqlalchemy import update
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
 
 from src.config import AVATAR_SIZES
-from src.core.services import get_avatars_root
+from src.core.services import avatar_cache, get_avatar_storage
+from src.core.storage import LocalStorage
+from src.core.throttling import throttle_backend
 from src.db import Base
-from src.db.database import get_db
+from src.db.database import get_db, get_read_db, instrument_engine
 from src.main import app
+from src.users.authentication import token_cache
+from src.users.cache import token_versions, user_cache
+from src.users.models import UserTable
+from src.users.revocation import revocations
 
 MIN_SIZE_AVATAR = min(AVATAR_SIZES)
 
@@ -20,6 +27,10 @@ TEMP_MEDIA_DIR = ROOT_DIR / 'media'
 TEMP_AVATARS_DIR = TEMP_MEDIA_DIR / 'avatars'
 BIG_B64_IMAGE = ROOT_DIR / 'helpers' / 'big_b64_image'
 
+STAFF_USER = {
+    'username': 'staff', 'phone': 7_900_000_0100, 'password': 'staffPass01'
+}
+
 test_engine = create_async_engine(
     # 'sqlite+aiosqlite:///./test.db',
     'sqlite+aiosqlite:///:memory:',
@@ -28,6 +39,8 @@ test_engine = create_async_engine(
     # echo=True,
 )
 
+instrument_engine(test_engine)
+
 TestSession = sessionmaker(
     bind=test_engine,
     class_=AsyncSession,
@@ -58,11 +71,23 @@ async def get_test_db() -> AsyncSession:
         await db.close()
 
 
+@pytest.fixture(name='db')
+async def get_test_session() -> AsyncSession:
+    async with TestSession() as db:
+        yield db
+
+
 @pytest.fixture(autouse=True)
 async def init_db():
     async with test_engine.begin() as conn:
         await conn.run_sync(Base.metadata.drop_all)
         await conn.run_sync(Base.metadata.create_all)
+    user_cache.clear()
+    token_versions.clear()
+    revocations.clear()
+    token_cache.clear()
+    avatar_cache.clear()
+    await throttle_backend.clear()
 
     yield
 
@@ -75,8 +100,38 @@ def get_http_client(temp_dirs):
     with TestClient(app) as client:
         app.root_path
         app.dependency_overrides[get_db] = get_test_db
-        app.dependency_overrides[get_avatars_root] = lambda: temp_dirs
+        app.dependency_overrides[get_read_db] = get_test_db
+        app.dependency_overrides[get_avatar_storage] = lambda: LocalStorage(
+            temp_dirs
+        )
 
         yield client
 
         app.dependency_overrides.clear()
+
+
+async def make_staff(phone: int) -> None:
+    async with TestSession() as db:
+        await db.execute(
+            update(UserTable).where(UserTable.phone == phone).values(
+                is_staff=True
+            )
+        )
+        await db.commit()
+
+
+@pytest.fixture(name='staff_client')
+def get_staff_client(http_client: TestClient) -> TestClient:
+    http_client.post(url='/registration', json=STAFF_USER)
+    http_client.portal.call(make_staff, STAFF_USER['phone'])
+    response = http_client.post(
+        url='/token',
+        data={
+            'username': STAFF_USER['phone'],
+            'password': STAFF_USER['password'],
+        }
+    )
+    http_client.headers['Authorization'] = (
+        'Bearer ' + response.json()['access_token']
+    )
+    return http_client
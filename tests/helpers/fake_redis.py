@@ -0,0 +1,34 @@
+from fnmatch import fnmatch
+from typing import AsyncIterator, Callable
+
+
+class FakeRedis:
+    """In-memory stand-in of the `redis.asyncio` client of throttling.
+
+    The hit script runs without awaiting, so it is atomic like in Redis.
+    """
+    def __init__(self) -> None:
+        self.data: dict[str, int] = {}
+
+    def register_script(self, script: str) -> Callable:
+        async def hit(keys: list[str], args: list[int]) -> list[int]:
+            previous_key, current_key = keys
+            self.data[current_key] = self.data.get(current_key, 0) + 1
+            return [self.data.get(previous_key, 0), self.data[current_key]]
+
+        return hit
+
+    async def decr(self, key: str) -> int:
+        self.data[key] -= 1
+        return self.data[key]
+
+    async def scan_iter(self, match: str) -> AsyncIterator[str]:
+        for key in list(self.data):
+            if fnmatch(key, match):
+                yield key
+
+    async def delete(self, key: str) -> None:
+        self.data.pop(key, None)
+
+    async def close(self) -> None:
+        pass
@@ -0,0 +1,59 @@
+import hashlib
+from email.utils import formatdate
+from urllib.parse import unquote
+
+import httpx
+
+
+class FakeS3:
+    """In-memory stand-in of an S3 bucket for `httpx.MockTransport`.
+    """
+    def __init__(self, bucket: str) -> None:
+        self.bucket = bucket
+        self.objects: dict[str, bytes] = {}
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        assert request.headers['authorization'].startswith('AWS4-HMAC-SHA256')
+        assert request.headers['x-amz-content-sha256'] == hashlib.sha256(
+            request.content
+        ).hexdigest()
+
+        path = unquote(request.url.path).removeprefix(f'/{self.bucket}')
+        key = path.removeprefix('/')
+        if not key and request.method == 'GET':
+            return self.list(request.url.params.get('prefix', ''))
+
+        if request.method == 'PUT':
+            self.objects[key] = request.content
+            return httpx.Response(200)
+
+        if key not in self.objects:
+            return httpx.Response(404)
+
+        if request.method == 'DELETE':
+            del self.objects[key]
+            return httpx.Response(204)
+
+        data = self.objects[key]
+        headers = {
+            'etag': '"%s"' % hashlib.md5(data).hexdigest(),
+            'last-modified': formatdate(usegmt=True),
+            'content-length': str(len(data)),
+        }
+        if request.method == 'HEAD':
+            return httpx.Response(200, headers=headers)
+        return httpx.Response(200, headers=headers, content=data)
+
+    def list(self, prefix: str) -> httpx.Response:
+        keys = ''.join(
+            f'<Contents><Key>{key}</Key></Contents>'
+            for key in sorted(self.objects) if key.startswith(prefix)
+        )
+        return httpx.Response(
+            200,
+            content=(
+                '<ListBucketResult xmlns='
+                '"http://s3.amazonaws.com/doc/2006-03-01/">'
+                f'{keys}</ListBucketResult>'
+            ).encode(),
+        )
@@ -0,0 +1,28 @@
+import re
+from contextlib import contextmanager
+from typing import Iterator
+
+from httpx import Response
+
+from src.db.database import QueryStats, track_queries
+
+SERVER_TIMING_RE = re.compile(r'db;dur=[\d.]+;desc="(\d+) queries"')
+
+
+def query_count(response: Response) -> int:
+    """Get the number of SQL statements of the request.
+    """
+    match = SERVER_TIMING_RE.search(response.headers['server-timing'])
+    assert match is not None, response.headers['server-timing']
+    return int(match.group(1))
+
+
+@contextmanager
+def assert_queries(expected: int) -> Iterator[QueryStats]:
+    """Check the number of SQL statements executed inside the block.
+    """
+    with track_queries() as stats:
+        yield stats
+    assert stats.count == expected, (
+        f'{stats.count} queries instead of {expected}'
+    )
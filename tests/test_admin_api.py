@@ -0,0 +1,179 @@
+import json
+import pstats
+from pathlib import Path
+
+from fastapi.testclient import TestClient
+
+from src.config import settings
+from tests.conftest import STAFF_USER
+
+
+def test_import_not_staff(http_client: TestClient):
+    user = {
+        'username': 'user1', 'phone': 7_900_000_0001, 'password': 'password01'
+    }
+    http_client.post(url='/registration', json=user)
+    response = http_client.post(
+        url='/token',
+        data={'username': user['phone'], 'password': user['password']},
+    )
+    token = response.json()['access_token']
+
+    response = http_client.post(
+        url='/users/import',
+        content=b'',
+        headers={
+            'Authorization': 'Bearer ' + token,
+            'Content-Type': 'text/csv',
+        },
+    )
+    assert response.status_code == 403, response.text
+
+
+def test_import_csv(staff_client: TestClient):
+    content = '\n'.join((
+        'username,phone,password',
+        'import1,79000001001,password01',
+        'import2,79000001002,password02',
+        'import1,79000001003,password03',
+        f'import4,{STAFF_USER["phone"]},password04',
+        'import5,123,password05',
+        'import6,79000001006',
+    ))
+    response = staff_client.post(
+        url='/users/import',
+        content=content.encode(),
+        headers={'Content-Type': 'text/csv'},
+    )
+    assert response.status_code == 200, response.text
+
+    report = response.json()
+    assert report['created'] == 2
+    assert [error['row'] for error in report['errors']] == [3, 4, 5, 6]
+
+    response = staff_client.post(
+        url='/token',
+        data={'username': 79000001002, 'password': 'password02'},
+    )
+    assert response.status_code == 200, response.text
+
+
+def test_import_ndjson(staff_client: TestClient):
+    rows = [
+        {'username': 'import1', 'phone': 79000001001, 'password': 'passwd01'},
+        {'username': 'import2', 'phone': 79000001001, 'password': 'passwd02'},
+    ]
+    content = '\n'.join(json.dumps(row) for row in rows) + '\n[]\n{'
+    response = staff_client.post(
+        url='/users/import',
+        content=content.encode(),
+        headers={'Content-Type': 'application/x-ndjson'},
+    )
+    assert response.status_code == 200, response.text
+
+    report = response.json()
+    assert report['created'] == 1
+    assert {error['row'] for error in report['errors']} == {2, 3, 4}
+
+    response = staff_client.post(
+        url='/users/import',
+        content=content.encode(),
+        headers={'Content-Type': 'text/plain'},
+    )
+    assert response.status_code == 415, response.text
+
+
+def test_export(staff_client: TestClient, monkeypatch):
+    monkeypatch.setattr(settings, 'export_chunk_size', 2)
+    for i in range(1, 5):
+        staff_client.post(url='/registration', json={
+            'username': f'export{i}',
+            'phone': 79000002000 + i,
+            'password': f'password0{i}',
+        })
+
+    response = staff_client.get(url='/users/export')
+    assert response.status_code == 200, response.text
+    assert response.headers['content-type'] == 'application/x-ndjson'
+    users = [json.loads(line) for line in response.text.splitlines()]
+    assert [user['id'] for user in users] == [1, 2, 3, 4, 5]
+    assert users[0]['username'] == STAFF_USER['username']
+    assert all('password' not in user for user in users)
+
+    response = staff_client.get(url='/users/export', params={'format': 'csv'})
+    assert response.status_code == 200, response.text
+    assert response.headers['content-type'].startswith('text/csv')
+    lines = response.text.splitlines()
+    assert lines[0] == 'id,username,phone,is_active,is_staff'
+    assert len(lines) == 6
+
+    response = staff_client.get(url='/users/export', params={'format': 'xml'})
+    assert response.status_code == 422, response.text
+
+
+def test_read_users(staff_client: TestClient):
+    for i in range(1, 6):
+        staff_client.post(url='/registration', json={
+            'username': f'page{i}' if i % 2 else f'other{i}',
+            'phone': 79000003000 + i,
+            'password': f'password0{i}',
+        })
+
+    response = staff_client.get(url='/users', params={'limit': 4})
+    assert response.status_code == 200, response.text
+    page = response.json()
+    assert [user['id'] for user in page['users']] == [1, 2, 3, 4]
+    assert page['users'][0]['is_staff'] is True
+
+    response = staff_client.get(
+        url='/users', params={'limit': 4, 'after': page['next_after']}
+    )
+    page = response.json()
+    assert [user['id'] for user in page['users']] == [5, 6]
+    assert page['next_after'] is None
+
+    response = staff_client.get(url='/users', params={'username': 'page'})
+    assert [user['username'] for user in response.json()['users']] == [
+        'page1', 'page3', 'page5'
+    ]
+
+    response = staff_client.get(url='/users', params={'is_staff': False})
+    assert len(response.json()['users']) == 5
+
+    response = staff_client.get(url='/users', params={'limit': 0})
+    assert response.status_code == 422, response.text
+
+
+def test_profiles(staff_client: TestClient, monkeypatch, tmp_path: Path):
+    monkeypatch.setattr(settings, 'profiling_token', 'secret')
+    monkeypatch.setattr(settings, 'profiles_dir', tmp_path)
+    monkeypatch.setattr(settings, 'profiling_keep', 2)
+
+    response = staff_client.get(url='/users/me')
+    assert 'x-profile-id' not in response.headers
+    response = staff_client.get(
+        url='/users/me', headers={'X-Profile': 'café'.encode()}
+    )
+    assert response.status_code == 200, response.text
+    assert 'x-profile-id' not in response.headers
+
+    names = []
+    for _ in range(3):
+        response = staff_client.get(
+            url='/users/me', headers={'X-Profile': 'secret'}
+        )
+        assert response.status_code == 200, response.text
+        names.append(response.headers['x-profile-id'])
+
+    response = staff_client.get(url='/profiles')
+    assert response.status_code == 200, response.text
+    assert [profile['name'] for profile in response.json()] == names[:0:-1]
+
+    response = staff_client.get(url=f'/profiles/{names[-1]}')
+    assert response.status_code == 200, response.text
+    path = tmp_path / 'download.prof'
+    path.write_bytes(response.content)
+    assert pstats.Stats(str(path)).total_calls > 0
+
+    response = staff_client.get(url=f'/profiles/{names[0]}')
+    assert response.status_code == 404, response.text
@@ -0,0 +1,92 @@
+import pytest
+
+from src.core.bloom import BloomFilter
+from src.core.cache import ByteLRUCache, LRUCache
+from src.core.exceptions import CredentialsException
+from src.users.authentication import (
+    create_access_token,
+    decode_token,
+    token_cache,
+)
+from src.users.cache import UserCache, UserSnapshot
+
+
+def test_lru_cache():
+    cache = LRUCache(maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert cache.stats() == {'size': 2, 'maxsize': 2, 'hits': 3, 'misses': 1}
+
+
+def test_lru_cache_ttl():
+    cache = LRUCache(maxsize=2, ttl=60)
+    cache.set('a', 1, ttl=0)
+    cache.set('b', 2)
+    assert cache.get('a') is None
+    assert cache.get('b') == 2
+    assert len(cache) == 1
+
+
+def test_lru_cache_disabled():
+    cache = LRUCache(maxsize=0)
+    cache.set('a', 1)
+    assert cache.get('a') is None
+
+
+def test_byte_lru_cache():
+    overhead = ByteLRUCache.entry_overhead
+    cache = ByteLRUCache(max_bytes=2 * (overhead + 10))
+    cache.set('a', b'0' * 10)
+    cache.set('b', None)
+    assert cache.get('b', default=...) is None
+    assert cache.bytes == 2 * overhead + 10
+
+    cache.set('c', b'0' * 10)
+    assert cache.get('a', default=...) is ...
+    assert cache.stats()['bytes'] == 2 * overhead + 10
+
+    cache.set('d', b'0' * 1000)
+    assert cache.get('d') is None
+    assert len(cache) == 2
+
+
+def test_user_cache_invalidate_id():
+    cache = UserCache(maxsize=2)
+    user = UserSnapshot(
+        id=1, username='user1', phone=79000000001,
+        is_active=True, is_staff=False,
+    )
+    cache.set(user.phone, user)
+    assert cache.get(user.phone) is user
+
+    cache.invalidate_id(user.id)
+    assert cache.get(user.phone) is None
+
+
+def test_token_cache():
+    token = create_access_token(data={'sub': '79000000001'})
+    token_cache.clear()
+
+    assert decode_token(token).phone == 79000000001
+    assert decode_token(token).phone == 79000000001
+    assert token_cache.stats()['hits'] == 1
+
+    with pytest.raises(CredentialsException):
+        decode_token(token[:-2])
+
+
+def test_bloom_filter():
+    bloom_filter = BloomFilter(capacity=1000, error_rate=0.01)
+    items = [f'item{i}' for i in range(1000)]
+    for item in items:
+        bloom_filter.add(item)
+    assert all(item in bloom_filter for item in items)
+    assert len(bloom_filter) == 1000
+
+    false_positives = sum(f'other{i}' in bloom_filter for i in range(10000))
+    assert false_positives < 300
@@ -0,0 +1,51 @@
+from fastapi.testclient import TestClient
+
+from src.core.metrics import Counter, Histogram
+
+
+def test_histogram():
+    histogram = Histogram('test_seconds', 'Test.', ('stage',), (0.1, 1))
+    histogram.observe(0.05, 'a')
+    histogram.observe(0.5, 'a')
+    histogram.observe(5, 'a')
+    assert list(histogram.render()) == [
+        '# HELP test_seconds Test.',
+        '# TYPE test_seconds histogram',
+        'test_seconds_bucket{stage="a",le="0.1"} 1',
+        'test_seconds_bucket{stage="a",le="1"} 2',
+        'test_seconds_bucket{stage="a",le="+Inf"} 3',
+        'test_seconds_sum{stage="a"} 5.55',
+        'test_seconds_count{stage="a"} 3',
+    ]
+
+
+def test_counter_labels():
+    counter = Counter('test_total', 'Test.', ('name',))
+    counter.inc('a "b"')
+    counter.inc('a "b"', amount=2)
+    assert list(counter.render())[-1] == r'test_total{name="a \"b\""} 3'
+
+
+def test_metrics(http_client: TestClient):
+    user = {
+        'username': 'user1', 'phone': 7_900_000_0001, 'password': 'password01'
+    }
+    http_client.post(url='/registration', json=user)
+    http_client.post(
+        url='/token',
+        data={'username': user['phone'], 'password': user['password']},
+    )
+    http_client.get(url='/users/1/avatar/50')
+
+    response = http_client.get(url='/metrics')
+    assert response.status_code == 200, response.text
+    assert response.headers['content-type'].startswith('text/plain')
+    text = response.text
+    assert (
+        'http_request_duration_seconds_count{method="GET",'
+        'route="/users/{user_id}/avatar/{size}",status="404"} 1'
+    ) in text
+    assert 'http_requests_in_flight 1' in text
+    assert 'password_hash_duration_seconds_count{operation="verify"}' in text
+    assert 'db_queries_total{statement="INSERT"}' in text
+    assert 'cache_hit_ratio{cache="user"}' in text
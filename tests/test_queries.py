@@ -0,0 +1,80 @@
+import logging
+
+from fastapi.testclient import TestClient
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.config import settings
+from src.db.database import redact_parameters, track_queries
+from src.users.models import orm
+from tests.helpers.queries import assert_queries, query_count
+
+
+def register(client: TestClient, count: int, start: int = 0) -> None:
+    for i in range(start, start + count):
+        client.post(url='/registration', json={
+            'username': f'user{i}',
+            'phone': 7_900_000_0001 + i,
+            'password': 'password01',
+        })
+
+
+def test_server_timing(staff_client: TestClient):
+    response = staff_client.get(url='/users/me')
+    assert response.status_code == 200, response.text
+    assert response.headers['server-timing'].startswith('db;dur=')
+    # The revocation filter and the user by phone (the token is not
+    # self-contained), then the user comes from the cache.
+    assert query_count(response) == 2
+    assert query_count(staff_client.get(url='/users/me')) == 0
+
+    response = staff_client.patch(url='/users/me', json={'username': 'new'})
+    assert response.status_code == 202, response.text
+    assert query_count(response) == 1
+
+
+def test_users_page_queries(staff_client: TestClient):
+    register(staff_client, 2)
+    staff_client.get(url='/users')  # loads the caches of authentication
+    count = query_count(staff_client.get(url='/users'))
+    assert count == 1
+
+    register(staff_client, 5, start=2)
+    response = staff_client.get(url='/users')
+    assert len(response.json()['users']) == 8
+    assert query_count(response) == count
+
+
+async def test_track_queries(db: AsyncSession):
+    with assert_queries(1):
+        await orm.get_page(db, limit=10)
+    with assert_queries(1):
+        await orm.get_credentials(db, 7_900_000_0001)
+
+
+async def test_slow_query_log(db: AsyncSession, monkeypatch, caplog):
+    monkeypatch.setattr(settings, 'slow_query_ms', 1e-9)
+    with caplog.at_level(logging.WARNING, logger='src.db.database'):
+        await orm.get_credentials(db, 7_900_000_0042)
+
+    assert 'Slow query' in caplog.text
+    assert 'parameters: (int, int, int)' in caplog.text
+    assert '79000000042' not in caplog.text
+
+
+def test_redact_parameters():
+    assert redact_parameters({'phone': 1, 'name': 'a'}) == (
+        '{phone: int, name: str}'
+    )
+    assert redact_parameters([(1, 'a'), (2, 'b')]) == '<2 rows>'
+    assert redact_parameters(()) == '()'
+
+
+async def test_failed_queries(db: AsyncSession):
+    user = {'username': 'user1', 'phone': 79000000001, 'password': 'hash'}
+    await orm.create(db, user)
+    with track_queries() as stats:
+        for _ in range(3):
+            _, err = await orm.create(db, user)
+            assert err is not None
+    # the failed INSERTs are counted too
+    assert stats.count == 3
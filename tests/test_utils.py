@@ -1,10 +1,48 @@
+import asyncio
+import base64
 import imghdr
+import io
 from pathlib import Path
+from time import time
+from types import SimpleNamespace
 
+import httpx
+import pytest
+from fastapi import BackgroundTasks, Request
+from passlib.context import CryptContext
 from PIL import Image
+from pydantic import ValidationError
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.core.services import Avatar
+from src.config import settings
+from src.core.exceptions import ServiceBusyException, TooManyRequestsException
+from src.core.executors import BoundedProcessPool
+from src.core.migrate_avatars import migrate_avatars
+from src.core.responses import accepted_quality
+from src.core.services import Avatar, avatar_cache, content_key
+from src.core.storage import LocalStorage, S3Storage
+from src.core.throttling import (
+    MemoryThrottleBackend,
+    RedisThrottleBackend,
+    sliding_window_wait,
+)
+from src.db.database import DatabaseRouter, create_engine, track_queries
+from src.users.authentication import (
+    authenticate_user,
+    check_login_rate,
+    rehash_password,
+)
+from src.users.cache import user_cache
+from src.users.calibrate import recommend_rounds
+from src.users.hashing import PasswordHasher, hasher
+from src.users.models import orm
+from src.users.revocation import RevocationList
+from src.users.schemes import UpdateUserScheme
 from tests.conftest import BIG_B64_IMAGE
+from tests.helpers.b64_images import base64image1, base64image2
+from tests.helpers.fake_redis import FakeRedis
+from tests.helpers.fake_s3 import FakeS3
 
 
 async def test_avatar(temp_dirs: Path):
@@ -12,25 +50,369 @@ async def test_avatar(temp_dirs: Path):
         original = f.read()
 
     user_id = '99'
+    storage = LocalStorage(temp_dirs)
     avatar = await Avatar(
         base64_data=original,
         user_id=user_id,
-        avatars_dir=temp_dirs
+        storage=storage
     )
-    assert imghdr.what(avatar.image) == 'png'
+    assert imghdr.what(storage.local_path(avatar.image)) == 'png'
+    assert await Avatar.get_digest(storage, user_id) == avatar.digest
 
-    user_avatars_dir = temp_dirs / user_id
-    original_image = user_avatars_dir / 'original.png'
-    assert original_image.exists()
+    timings = await avatar.save_resized_avatars()
+    assert 'decode' in timings
+    for ext in ('png', 'webp'):
+        sizes = set(avatar.sizes.copy())
+        for width, _ in avatar.sizes:
+            data = await storage.get(
+                content_key(avatar.digest, f'{width}.{ext}')
+            )
+            sizes.remove(Image.open(io.BytesIO(data)).size)
 
-    await avatar.save_resized_avatars()
-    avatars = (
-        img for img in user_avatars_dir.iterdir() if img.name != 'original.png'
+        assert not sizes
+
+    assert all(saved > 0 for saved in avatar.savings.values())
+    assert await Avatar.base64_min_avatar(storage, user_id)
+
+
+async def test_password_hasher():
+    hasher = PasswordHasher(BoundedProcessPool(max_workers=1, max_queue=1))
+    try:
+        hash_password = await hasher.hash('password01')
+        assert await hasher.verify('password01', hash_password)
+        assert not await hasher.verify('password02', hash_password)
+
+        # chunks are submitted one per worker, within the queue limit
+        passwords = [f'password{i:02}' for i in range(6)]
+        hashes = await hasher.hash_many(passwords)
+        assert [
+            await hasher.verify(password, hash_password)
+            for password, hash_password in zip(passwords, hashes)
+        ] == [True] * 6
+        assert not await hasher.verify(passwords[1], hashes[0])
+    finally:
+        hasher.shutdown()
+
+
+async def test_pool_rejects_over_limit():
+    pool = BoundedProcessPool(max_workers=1, max_queue=0)
+    pool.pending = pool.limit
+    with pytest.raises(ServiceBusyException):
+        await pool.run(sum, (1, 2))
+
+
+@pytest.mark.parametrize(
+    'accept, media_type, quality',
+    [
+        ('image/webp,image/*;q=0.8', 'image/webp', 1.0),
+        ('image/webp,image/*;q=0.8', 'image/avif', 0.8),
+        ('image/png', 'image/webp', 0.0),
+        ('*/*;q=0.5', 'image/webp', 0.5),
+        ('image/*;q=0.5, image/webp;q=0', 'image/webp', 0.0),
+    ]
+)
+def test_accepted_quality(accept: str, media_type: str, quality: float):
+    assert accepted_quality(accept, media_type) == quality
+
+
+async def test_avatar_deduplication(temp_dirs: Path):
+    storage = LocalStorage(temp_dirs)
+    first = await Avatar(base64image1.encode(), '101', storage)
+    await first.save_resized_avatars()
+    second = await Avatar(base64image1.encode(), '102', storage)
+    assert second.digest == first.digest
+    assert second.resized
+    assert await second.save_resized_avatars() == {}
+
+    content = content_key(first.digest, '')
+    await Avatar.delete(storage, '101')
+    assert await Avatar.get_digest(storage, '101') is None
+    assert await storage.list(content)
+
+    other = await Avatar(base64image2.encode(), '102', storage)
+    assert other.digest != first.digest
+    assert not await storage.list(content)
+
+
+async def test_migrate_avatars(temp_dirs: Path):
+    legacy_dir = temp_dirs / '7'
+    legacy_dir.mkdir()
+    Image.open(io.BytesIO(base64.b64decode(base64image1))).save(
+        legacy_dir / '100.png'
     )
-    sizes = set(avatar.sizes.copy())
+    storage = LocalStorage(temp_dirs)
+
+    assert await migrate_avatars(temp_dirs, storage) == 1
+    assert not legacy_dir.exists()
+    digest = await Avatar.get_digest(storage, '7')
+    assert await storage.stat(content_key(digest, '50.png'))
+    assert await migrate_avatars(temp_dirs, storage) == 0
+
+
+async def test_avatar_keeps_unreferenced(temp_dirs: Path, monkeypatch):
+    monkeypatch.setattr(settings, 'avatar_delete_unreferenced', False)
+    storage = LocalStorage(temp_dirs)
+    avatar = await Avatar(base64image1.encode(), '103', storage)
+    await Avatar.delete(storage, '103')
+    assert await Avatar.get_digest(storage, '103') is None
+    assert await storage.stat(content_key(avatar.digest, 'original.png'))
+
+
+async def test_s3_storage():
+    fake_s3 = FakeS3('avatars')
+    storage = S3Storage(
+        endpoint_url='http://s3.test',
+        bucket='avatars',
+        access_key='key',
+        secret_key='secret',
+        client=httpx.AsyncClient(transport=httpx.MockTransport(fake_s3)),
+    )
+    await storage.put('content/a/1.png', b'123')
+    await storage.put('content/b/1.png', b'4567')
+    assert await storage.get('content/a/1.png') == b'123'
+    assert await storage.get('content/c/1.png') is None
+    assert (await storage.stat('content/b/1.png')).size == 4
+    assert await storage.list('content/a/') == ['content/a/1.png']
+    assert b''.join(
+        [chunk async for chunk in storage.stream('content/b/1.png')]
+    ) == b'4567'
+
+    avatar = await Avatar(base64image1.encode(), '1', storage)
+    await avatar.save_resized_avatars()
+    assert await Avatar.base64_min_avatar(storage, '1')
+
+    await storage.delete('content/a/1.png')
+    assert await storage.stat('content/a/1.png') is None
+    await storage.close()
+
+
+async def test_avatar_cache_expires_misses(temp_dirs: Path, monkeypatch):
+    storage = LocalStorage(temp_dirs)
+    assert await Avatar.base64_min_avatar(storage, '42') is None
+    assert avatar_cache.get('42', default=...) is None
+
+    # another worker uploads the avatar, the miss is not served for long
+    monkeypatch.setattr(settings, 'avatar_cache_miss_ttl', 0)
+    avatar_cache.clear()
+    assert await Avatar.base64_min_avatar(storage, '42') is None
+    assert avatar_cache.get('42', default=...) is ...
+
+
+async def test_sqlite_pragmas(tmp_path: Path):
+    engine = create_engine(f'sqlite+aiosqlite:///{tmp_path / "test.db"}')
+    async with engine.connect() as conn:
+        assert await conn.scalar(text('PRAGMA journal_mode')) == 'wal'
+        assert await conn.scalar(text('PRAGMA synchronous')) == 1
+        assert await conn.scalar(text('PRAGMA busy_timeout')) == 5000
+    assert engine.pool.size() == 5
+    await engine.dispose()
+
+
+async def test_auth_lookups(db: AsyncSession):
+    for i in (1, 2):
+        await orm.create(db, {
+            'username': f'user{i}',
+            'phone': 79000000000 + i,
+            'password': f'hash{i}',
+            'is_active': True,
+        })
+
+    for i in (1, 2):
+        user = await orm.get_auth_user(db, phone=79000000000 + i)
+        assert (user.id, user.username) == (i, f'user{i}')
+        assert 'password' not in user._fields
+        user = await orm.get_auth_user(db, id=i)
+        assert user.phone == 79000000000 + i
+        credentials = await orm.get_credentials(db, 79000000000 + i)
+        assert credentials.password == f'hash{i}'
+
+    assert await orm.get_auth_user(db, id=3) is None
+    assert await orm.get_credentials(db, 79000000003) is None
+
+
+async def test_database_router(tmp_path: Path):
+    engines = []
+    for i, name in enumerate(('primary', 'replica1', 'replica2')):
+        engine = create_engine(f'sqlite+aiosqlite:///{tmp_path / name}.db')
+        async with engine.begin() as conn:
+            await conn.execute(text(f'PRAGMA user_version={i}'))
+        engines.append(engine)
+    broken = create_engine(f'sqlite+aiosqlite:///{tmp_path}/no/such.db')
+    db_router = DatabaseRouter(engines[0], [*engines[1:], broken], 60)
+
+    async def read_version(state=None) -> int:
+        async with await db_router.read_session(state) as db:
+            return await db.scalar(text('PRAGMA user_version'))
+
+    # the broken replica falls back to the next one and is skipped then
+    assert [await read_version() for _ in range(5)] == [1, 2, 1, 1, 2]
+    assert len(db_router.candidates()) == 2
+    # healthy replicas are checked once per interval, not per session
+    assert len(db_router._checked_until) == 2
+
+    state = type('State', (), {})()
+    read_db = await db_router.read_session(state)
+    assert await read_db.scalar(text('PRAGMA user_version')) in (1, 2)
+    async with db_router.write_session(state) as db:
+        assert await db.scalar(text('PRAGMA user_version')) == 0
+        await db.commit()
+    assert state.db_written is True
+    assert await read_version(state) == 0
+    # a session opened before the write reads the primary after it
+    assert await read_db.scalar(text('PRAGMA user_version')) == 0
+    await read_db.close()
+
+    for engine in engines + [broken]:
+        await engine.dispose()
+
+
+@pytest.mark.parametrize('returning', [True, False])
+async def test_crud_returning(db: AsyncSession, monkeypatch, returning: bool):
+    if not returning:
+        monkeypatch.setattr(orm, '_returning', lambda db, statement: False)
+
+    user = {'username': 'user1', 'phone': 79000000001, 'password': 'hash'}
+    with track_queries() as stats:
+        row, err = await orm.create_returning(db, user)
+    assert err is None
+    assert (row.id, row.username, row.is_active) == (1, 'user1', False)
+    # the fallback reads the row back once
+    assert stats.count == (1 if returning else 2)
+
+    row, err = await orm.create_returning(db, user)
+    # Both columns conflict. `Table.indexes` is a set, so the order of
+    # the unique indexes, and the one SQLite reports, varies per process.
+    assert row is None and err in ('username', 'phone')
+
+    row, err = await orm.update_returning(db, 1, {'username': 'user2'})
+    assert err is None and row.username == 'user2'
+    assert user_cache.get(user['phone']).username == 'user2'
+
+    row, err = await orm.update_returning(db, 2, {'username': 'user3'})
+    assert row is None and err is None
+
+
+def test_recommend_rounds():
+    rounds, timings = recommend_rounds(target=0, samples=1)
+    assert rounds == 4
+    assert list(timings) == [4]
+
+
+async def test_rehash_on_login(db: AsyncSession):
+    old_hash = CryptContext(['bcrypt'], bcrypt__rounds=4).hash('password01')
+    assert hasher.needs_update(old_hash)
+    await orm.create(db, {
+        'username': 'user1',
+        'phone': 79000000001,
+        'password': old_hash,
+        'is_active': True,
+    })
+
+    tasks = BackgroundTasks()
+    user = await authenticate_user(db, 79000000001, 'password01', tasks)
+    assert user.password == old_hash
+    await tasks()
+
+    new_hash = (await orm.get_credentials(db, 79000000001)).password
+    assert new_hash != old_hash and not hasher.needs_update(new_hash)
+
+    tasks = BackgroundTasks()
+    await authenticate_user(db, 79000000001, 'password01', tasks)
+    assert not tasks.tasks
+
+    # a rehash after a change of the password does not restore the old one
+    await rehash_password(db, 1, 'password01', old_hash)
+    assert (await orm.get_credentials(db, 79000000001)).password == new_hash
+
+
+@pytest.mark.parametrize(
+    'previous, current, elapsed, wait',
+    [
+        (0, 4, 30, 0),
+        (10, 0, 40, 0),
+        (10, 0, 30, 6),
+        (10, 4, 45, 15),
+        (0, 5, 30, 42),
+        (0, 10, 0, 96),
+    ],
+)
+def test_sliding_window_wait(
+    previous: int, current: int, elapsed: float, wait: float
+):
+    assert sliding_window_wait(previous, current, elapsed, 5, 60) == wait
+
+
+async def test_redis_throttle_backend():
+    client = FakeRedis()
+    backend = RedisThrottleBackend(client=client)
+    results = await asyncio.gather(*(
+        backend.hit('key', 2, 60) for _ in range(5)
+    ))
+    assert sum(wait == 0 for wait in results) == 2
+    # rejected hits are not counted
+    assert list(client.data.values()) == [2]
+
+    await backend.clear()
+    assert not client.data
+    assert await backend.hit('key', 2, 60) == 0
+
+
+async def test_memory_throttle_backend():
+    backend = MemoryThrottleBackend()
+    assert [await backend.hit('key', 2, 60) == 0 for _ in range(3)] == [
+        True, True, False
+    ]
+    assert await backend.hit('other', 2, 60) == 0
+
+
+async def test_revocation_list(db: AsyncSession):
+    revocations = RevocationList(capacity=100, refresh=60)
+    now = int(time())
+    await revocations.revoke(db, 'revoked', now + 60)
+    await revocations.revoke(db, 'expired', now - 1)
+    assert await revocations.is_revoked(db, 'revoked')
+
+    # a new process loads the revoked tokens from the database
+    revocations = RevocationList(capacity=100, refresh=60)
+    assert await revocations.is_revoked(db, 'revoked')
+    assert not await revocations.is_revoked(db, 'expired')
+    assert not await revocations.is_revoked(db, 'other')
+    assert len(revocations.filter) == 1
+
+
+async def test_revoke_during_load(db: AsyncSession):
+    revocations = RevocationList(capacity=100, refresh=60)
+
+    class StreamingDb:
+        async def stream_scalars(self, statement):
+            async def rows():
+                # another request revokes a token while the filter loads
+                await revocations.revoke(db, 'during', int(time()) + 60)
+                yield 'before'
+
+            return rows()
+
+    await revocations.load(StreamingDb())
+    assert 'during' in revocations.filter
+    assert await revocations.is_revoked(db, 'during')
+
+
+@pytest.mark.parametrize(
+    'password, valid',
+    [(None, True), ('qwe7RTY8asd', True), ('aaaaaaab', False)],
+)
+def test_update_password_validator(password: str | None, valid: bool):
+    if valid:
+        assert UpdateUserScheme(password=password).password == password
+    else:
+        with pytest.raises(ValidationError):
+            UpdateUserScheme(password=password)
 
-    for image in avatars:
-        size = Image.open(image).size
-        sizes.remove(size)
 
-    assert not sizes
+async def test_login_rate_without_client(monkeypatch):
+    monkeypatch.setattr(settings, 'login_rate_per_ip', 1)
+    request = Request({'type': 'http', 'headers': [], 'client': None})
+    form = SimpleNamespace(username=79000000001)
+    await check_login_rate(request, form)
+    with pytest.raises(TooManyRequestsException):
+        await check_login_rate(request, form)